@@ -7,6 +7,7 @@ import asyncio
 import aiohttp
 from aiohttp.client_exceptions import ClientResponseError
 from data.models import *
+import data.views as views
 from utils import imgupload
 import auth
 import cookbook
@@ -92,12 +93,14 @@ def add_admin_routes(app: Sanic):
         if id not in recipes:
             raise NotFound("No such recipe exists on this website")
 
-        # delete all info
+        # delete all info, including the views that were not stored yet
+        await views.flush_views()
         await asyncio.gather(
             cookbook.delete_recipe(collection, id),
             Views.delete_recipe(collection, id),
             Comment.delete_recipe(collection, id),
             Save.delete_recipe(collection, id),
+            RecipeStats.delete_recipe(collection, id),
         )
         return sanic.empty()
 
@@ -293,11 +296,13 @@ def add_admin_routes(app: Sanic):
         recipe = await cookbook.delete_recipe(collectionfrom, id)
         idto = await cookbook.add_recipe(collectionto, recipe)
 
-        # move user data
+        # move user data, including the views that were not stored yet
+        await views.flush_views()
         await asyncio.gather(
             Views.move_recipe(collectionfrom, collectionto, id, idto),
             Comment.move_recipe(collectionfrom, collectionto, id, idto),
-            Save.move_recipe(collectionfrom, collectionto, id, idto)
+            Save.move_recipe(collectionfrom, collectionto, id, idto),
+            RecipeStats.move_recipe(collectionfrom, collectionto, id, idto)
         )
         return sanic.json({
             "redirect": app.url_for("recipe", id=idto, collection=collectionto)
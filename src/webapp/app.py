@@ -4,13 +4,15 @@ import datetime
 import string
 import os
 from utils.compress import init_compression
+from utils.pagecache import init_page_cache
+from utils.edgecache import purge_recipes
 from utils.minifyloader import MinifyingFileSystemLoader
 from utils.imgupload import init_client
 
 import cookbook
 import auth
 import session
-from data import init_db
+from data import init_db, init_views, close_views, init_sessions
 from limiter import init_limiter, close_limiter, RateLimiter
 
 
@@ -28,19 +30,10 @@ def _strftimestamp(timestamp):
     return date.strftime("%Y-%m-%d")
 
 
-def _addIngredient_references(step: str, recipe: cookbook.Recipe):
-    """ Add ingredient references to recipe step """
-    return cookbook.replace_ingredient_references(
-        step, 
-        tuple(ingredient.ingredient for ingredient in recipe.ingredients)
-    )
-
-
 # 10MB max request size
 app.config.REQUEST_MAX_SIZE = 10000000
 
 app.ext.templating.environment.filters["strftimestamp"] = _strftimestamp
-app.ext.templating.environment.filters["ingredientrefs"] = _addIngredient_references
 app.ext.templating.environment.filters["capwords"] = string.capwords
 app.ext.templating.environment.globals["CUISINE_TYPES"] = cookbook.CUISINE_TYPES
 app.ext.templating.environment.globals["MEAL_TYPES"] = cookbook.MEAL_TYPES
@@ -68,8 +61,15 @@ auth.init_jwt(
     60 * 60
 )
 
+init_sessions(app)
+
 app.before_server_start(init_db)
+app.before_server_start(init_views)
+app.before_server_stop(close_views)
 app.before_server_start(init_client)
+app.before_server_start(cookbook.init_cookbook)
+app.before_server_stop(cookbook.close_cookbook)
+cookbook.on_push(purge_recipes)
 
 # global rate limit of 5 requests per second
 app.ctx.global_limiter = RateLimiter(times=5, seconds=1)
@@ -77,3 +77,4 @@ app.before_server_start(init_limiter)
 app.after_server_stop(close_limiter)
 
 init_compression(app)
+init_page_cache("templates/")
@@ -38,10 +38,11 @@ def init_jwt(app: Sanic, secret=None, expiration_delta=None):
             request.ctx.user = None
 
 
-def _encode_jwt(app: Sanic, username: str):
+def _encode_jwt(app: Sanic, username: str, user_id: int | None = None):
     """ Encode a JWT token for the given username """
     payload = {
         "username": username,
+        "uid": user_id,
         "scopes": ['user'],
         "exp": datetime.datetime.now(datetime.UTC) + datetime.timedelta(
             seconds=app.config["jwt_expiration_delta"])
@@ -102,6 +103,14 @@ def get_username(request: Request):
     return request.ctx.user["username"]
 
 
+def get_user_id(request: Request) -> int | None:
+    """ Helper function to retrieve the user id from request context,
+    None for tokens from before user ids were included """
+    if not request.ctx.user:
+        return None
+    return request.ctx.user.get("uid")
+
+
 def is_admin(request: Request):
     """ Helper function to retrieve admin role status from request
     context, without having to deal with the context manually. """
@@ -118,9 +127,9 @@ def is_user(request: Request):
     return "user" in request.ctx.user["scopes"]
 
 
-def login_user(username: str, request: Request, response: HTTPResponse):
+def login_user(username: str, request: Request, response: HTTPResponse, user_id: int | None = None):
     """ Login the given user by setting the JWT token cookie """
-    token = _encode_jwt(request.app, username)
+    token = _encode_jwt(request.app, username, user_id)
     response.add_cookie(
         JWT_COOKIE_NAME, token,
         httponly=True,
@@ -1,7 +1,8 @@
 from .recipe import Recipe
-from .cookbook import get_recipes, get_collection_etag, add_recipe, update_recipe, delete_recipe, DEFAULT_COLLECTION, COLLECTIONS
+from .index import CollectionIndex, TAG_FIELDS
+from .cookbook import get_recipes, get_collection_index, search_recipes, match_ingredients, get_recipe_steps, get_collection_etag, add_recipe, update_recipe, delete_recipe, init_cookbook, close_cookbook, on_push, DEFAULT_COLLECTION, COLLECTIONS
 from .transform import translate_url, translate_page
 from .usage import get_usage
 from .meta import *
 from .title import generate_title
-from .references import replace_ingredient_references
+from .references import replace_ingredient_references, annotate_steps
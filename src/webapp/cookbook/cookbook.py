@@ -1,6 +1,7 @@
+import asyncio
 import datetime
+import functools
 import aiohttp
-import base64
 import msgspec.json
 import string
 import random
@@ -8,14 +9,53 @@ import dataclasses
 import os
 import logging
 
+from collections.abc import Awaitable, Callable
+from typing import TYPE_CHECKING
+if TYPE_CHECKING:
+    from sanic import Sanic
+
 from .recipe import Recipe
+from .schema import decode_recipe, decode_recipes, encode_recipe, encode_recipes
+from .merge import merge_recipe
+from .index import CollectionIndex
+from .search import SearchIndex
+from .ingredients import IngredientIndex
+from .steps import RecipeSteps
 from .utils import *
+from .store import get_store
+from . import shared
+from . import snapshot
 
 logger = logging.getLogger(__name__)
 
-RECIPE_REPO_USER = os.environ["RECIPE_REPO_USER"]
-RECIPE_REPO_NAME = os.environ["RECIPE_REPO_NAME"]
-RECIPE_PAT = os.environ["RECIPE_PAT"]
+# storage backend of the collections, see store.py
+RECIPE_STORE = os.environ.get("RECIPE_STORE", "file")
+
+# after the soft TTL, a cached collection is still served, but it
+# is refreshed in the background (stale-while-revalidate)
+# after the hard TTL, requests wait for the refreshed collection
+RECIPE_SOFT_TTL = datetime.timedelta(seconds=int(os.environ.get("RECIPE_SOFT_TTL", 15 * 60)))
+RECIPE_HARD_TTL = datetime.timedelta(seconds=int(os.environ.get("RECIPE_HARD_TTL", 60 * 60)))
+
+# time to wait before retrying a failed refresh,
+# the stale collection is served in the meantime
+RECIPE_RETRY_DELAY = datetime.timedelta(seconds=30)
+
+# changes are applied to the cache right away, and pushed (write-behind)
+# after collecting changes for RECIPE_PUSH_DELAY, as a single commit
+# failed pushes are retried with exponential backoff, up to RECIPE_PUSH_MAX_DELAY
+# between attempts, until they succeed, after RECIPE_PUSH_RETRIES attempts
+# the failures are logged as errors
+RECIPE_PUSH_DELAY = datetime.timedelta(seconds=float(os.environ.get("RECIPE_PUSH_DELAY", 2)))
+RECIPE_PUSH_MAX_DELAY = datetime.timedelta(seconds=float(os.environ.get("RECIPE_PUSH_MAX_DELAY", 5 * 60)))
+RECIPE_PUSH_RETRIES = int(os.environ.get("RECIPE_PUSH_RETRIES", 5))
+
+# time to wait for a push in flight when stopping, changes that are
+# not pushed by then are kept next to the snapshots for the next worker
+RECIPE_CLOSE_TIMEOUT = datetime.timedelta(seconds=10)
+
+# called with (collection, changed recipe ids) after every push
+_PUSH_CALLBACKS: list[Callable[[str, list[str]], Awaitable[None]]] = []
 
 
 class CollectionCache:
@@ -25,8 +65,43 @@ class CollectionCache:
 
     def __init__(self):
         self.recipes: dict[str, Recipe] = None
-        self.sha: str = None  # file SHA from GitHub API
-        self.recipe_timeout = None
+        self.sha: str = None  # file (or directory) SHA from GitHub API
+        self.etag: str = None  # response ETag from GitHub API
+        self.blobs: dict[str, str] = None  # file SHA per recipe, if stored separately
+        self.recipe_timeout = None  # soft TTL
+        self.stale_timeout = None  # hard TTL
+        self.retry_timeout = None  # after failed refresh
+
+        # bumped on every local change, so refreshes that
+        # started before the change can be discarded
+        self.version = 0
+
+        # refresh in flight, at most one per collection
+        self.refresh_task: asyncio.Task | None = None
+
+        # changes that are not pushed yet (None for deleted recipes),
+        # the retrieved recipes they were made on, and the push that will push them
+        self.pending: dict[str, Recipe | None] = {}
+        self.pending_base: dict[str, Recipe | None] = {}
+        self.pending_messages: list[str] = []
+        self.push_task: asyncio.Task | None = None
+
+        # the push to the repository in flight, not cancelled with the push task,
+        # so a push is never aborted halfway
+        self.push_attempt: asyncio.Task | None = None
+
+        # built on first use after the recipes changed, the search
+        # index is updated for the changed recipes only
+        self._index: CollectionIndex | None = None
+        self._search = SearchIndex()
+        self._search_synced = False
+        self._ingredients = IngredientIndex()
+        self._ingredients_synced = False
+
+        # annotated steps per recipe version, computed in the background
+        self.steps = RecipeSteps()
+        self.steps_synced = False
+        self.steps_task: asyncio.Task | None = None
 
     def asdict(self):
         return {
@@ -35,12 +110,89 @@ class CollectionCache:
         }
 
     def reset_timeout(self):
-        self.recipe_timeout = datetime.datetime.now() + datetime.timedelta(minutes=15)
+        now = datetime.datetime.now()
+        self.recipe_timeout = now + RECIPE_SOFT_TTL
+        self.stale_timeout = now + RECIPE_HARD_TTL
+        self.retry_timeout = None
+
+    def is_loaded(self) -> bool:
+        return self.recipes is not None and self.sha is not None
+
+    def is_fresh(self) -> bool:
+        """ Cached collection is within its soft TTL """
+        return self.is_loaded() \
+            and self.recipe_timeout is not None \
+            and datetime.datetime.now() <= self.recipe_timeout
+
+    def is_servable(self) -> bool:
+        """ Cached collection is within its hard TTL """
+        return self.is_loaded() \
+            and self.stale_timeout is not None \
+            and datetime.datetime.now() <= self.stale_timeout
+
+    def load(self, recipes: dict[str, Recipe]):
+        """ Load retrieved recipes, with the pending changes merged on top """
+        for recipe_id, recipe in self.pending.items():
+            remote = recipes.get(recipe_id)
+            merged = merge_recipe(self.pending_base[recipe_id], recipe, remote)
+
+            # the pending change now applies to the retrieved recipe
+            self.pending[recipe_id] = merged
+            self.pending_base[recipe_id] = remote
+            if merged is None:
+                recipes.pop(recipe_id, None)
+            else:
+                recipes[recipe_id] = merged
+        self.recipes = recipes
+        self._index = None
+        self._search_synced = False
+        self._ingredients_synced = False
+        self.steps_synced = False
+
+    def apply(self, changes: dict[str, Recipe | None]):
+        """ Apply local changes, and mark them as pending """
+        for recipe_id, recipe in changes.items():
+            if recipe_id not in self.pending:
+                self.pending_base[recipe_id] = self.recipes.get(recipe_id)
+            self.pending[recipe_id] = recipe
+            if recipe is None:
+                self.recipes.pop(recipe_id, None)
+            else:
+                self.recipes[recipe_id] = recipe
+        self._index = None
+        self._search_synced = False
+        self._ingredients_synced = False
+        self.steps_synced = False
+
+    @property
+    def index(self) -> CollectionIndex:
+        if self._index is None:
+            self._index = CollectionIndex(self.recipes)
+        return self._index
+
+    @property
+    def search(self) -> SearchIndex:
+        if not self._search_synced:
+            self._search.sync(self.recipes)
+            self._search_synced = True
+        return self._search
+
+    @property
+    def ingredients(self) -> IngredientIndex:
+        if not self._ingredients_synced:
+            self._ingredients.sync(self.recipes)
+            self._ingredients_synced = True
+        return self._ingredients
 
     def clear(self):
         self.recipes = None
+        self._index = None
         self.sha = None
+        self.etag = None
+        self.blobs = None
         self.recipe_timeout = None
+        self.stale_timeout = None
+        self.version += 1
 
 
 DEFAULT_COLLECTION = "recipes"
@@ -51,6 +203,7 @@ COLLECTIONS = {
 
 # initialize with empty caches
 _COLLECTIONS = {c: CollectionCache() for c in COLLECTIONS}
+_STORE = get_store(RECIPE_STORE)
 
 
 def _now() -> float:
@@ -65,68 +218,223 @@ def _get_collection(collection) -> CollectionCache:
     return _COLLECTIONS[collection]
 
 
-async def _get_recipes(collection) -> CollectionCache:
+def _refresh_done(collection: str, task: asyncio.Task):
+    """ Clean up a finished collection refresh """
+    col = _get_collection(collection)
+    col.refresh_task = None
+    if not task.cancelled() and task.exception() is not None:
+        logger.warning(f"Failed to refresh collection {collection}: {task.exception()}")
+        col.retry_timeout = datetime.datetime.now() + RECIPE_RETRY_DELAY
+
+
+def _refresh_recipes(collection: str) -> asyncio.Task:
+    """ Start refreshing a collection, or get the refresh
+    that is already in flight (single-flight) """
+    col = _get_collection(collection)
+    if col.refresh_task is None:
+        col.refresh_task = asyncio.create_task(_fetch_recipes(collection))
+        col.refresh_task.add_done_callback(functools.partial(_refresh_done, collection))
+    return col.refresh_task
+
+
+async def _get_recipes(collection, allow_stale=True) -> CollectionCache:
     """ Refresh cache, and get collection """
     col = _get_collection(collection)
 
-    # check collection cache timeout
-    if col.recipe_timeout is not None:
-        if datetime.datetime.now() > col.recipe_timeout:
-            logger.info(f"Collection {collection} expired")
-            col.recipe_timeout = None
+    if col.is_fresh():
+        return col
 
-    if col.recipes is not None and col.recipe_timeout is not None and col.sha is not None:
-        # invalid timeout, reset it
-        col.reset_timeout()
+    if allow_stale and col.is_loaded() \
+            and col.retry_timeout is not None and datetime.datetime.now() <= col.retry_timeout:
+        # the last refresh failed, keep serving the stale collection for now
+        return col
+
+    if allow_stale and col.is_servable():
+        # serve the stale collection, and refresh it in the background
+        if col.refresh_task is None:
+            logger.info(f"Collection {collection} expired, refreshing in background")
+        _refresh_recipes(collection)
         return col
 
-    # refresh cached collection
-    async with aiohttp.ClientSession() as session:
-        logger.info(f"Retrieving collection {collection}")
+    # no usable collection, wait for the refresh
+    # shield the refresh, as other requests may be waiting for it as well
+    # the refresh may be discarded on a local change, in which case we retry
+    while True:
         try:
-            # get recipe collection from GitHub repo
-            # use GitHub API, as the repo may be private
-            res = await session.get(
-                f"https://api.github.com/repos/{RECIPE_REPO_USER}/{RECIPE_REPO_NAME}/contents/{collection}.json",
-                headers={
-                    "accept": "application/vnd.github+json",
-                    "authorization": f"token {RECIPE_PAT}"
-                }
-            )
-        except aiohttp.ClientConnectionError:
-            raise CookbookError(f"Error getting recipes: failed to connect")
-
-        if not res.ok:
-            raise CookbookError(f"Error getting recipes: {res.status} ({await res.text()})")
-
-        # save all data from the repo
-        # (part of) this is needed to correctly
-        # push the updated collection on an update
-        file = await res.json()
-        col.sha = file["sha"]
-        recipes = msgspec.json.decode(
-            base64.b64decode(file["content"]),
-            strict=False
-        )
+            await asyncio.shield(_refresh_recipes(collection))
+        except (CookbookError, aiohttp.ClientError):
+            if not allow_stale or not col.is_loaded():
+                raise
 
-        # load the recipes
-        col.recipes = {
-            recipe_id: Recipe.from_data(**recipe)
-            for recipe_id, recipe in recipes.items()
-        }
+            # the repository is unavailable, serve the stale collection
+            logger.warning(f"Serving stale collection {collection}")
+            return col
+
+        if col.is_loaded():
+            return col
+
+
+def _ttl_ms(ttl: datetime.timedelta) -> int:
+    return int(ttl.total_seconds() * 1000)
+
+
+async def _store_recipes(collection: str, data: bytes | None):
+    """ Store the cached collection in the shared cache and its snapshot.
+    Without data, only the pointer to the current collection is refreshed """
+    col = _get_collection(collection)
+    await shared.put_collection(
+        collection, col.sha, col.etag, data,
+        ttl_ms=_ttl_ms(RECIPE_SOFT_TTL),
+        data_ttl_ms=_ttl_ms(RECIPE_HARD_TTL)
+    )
+    if data is not None:
+        await snapshot.write_snapshot(collection, col.sha, col.etag, data)
+
+
+async def _load_shared_recipes(collection: str, version: int) -> bool:
+    """ Load a collection from the shared cache, if another
+    worker retrieved it recently. Return whether this succeeded. """
+    col = _get_collection(collection)
+    pointer = await shared.get_pointer(collection)
+    if pointer is None:
+        return False
+
+    if col.is_loaded() and pointer.sha == col.sha:
+        # our cached collection is still the current one
+        data = None
+    else:
+        data = await shared.get_collection(collection, pointer.sha)
+        if data is None:
+            return False
+
+    if col.version != version:
+        logger.info(f"Discarding shared collection {collection}, it changed while retrieving")
+        return True
+
+    col.etag = pointer.etag
+    col.reset_timeout()
+    if data is not None:
+        logger.info(f"Loading collection {collection} from shared cache")
+        col.load(decode_recipes(data))
+        col.sha = pointer.sha
+        _annotate_recipes(collection)
+        await snapshot.write_snapshot(collection, col.sha, col.etag, data)
+    return True
+
+
+async def _fetch_recipes(collection):
+    """ Retrieve a collection into the cache, from the shared
+    cache if possible, and from the repository otherwise """
+    col = _get_collection(collection)
+    version = col.version
+
+    if await _load_shared_recipes(collection, version):
+        return
+
+    locked = await shared.acquire_fetch_lock(collection)
+    if not locked:
+        # another worker is retrieving the collection, wait for it to share it
+        for _ in range(shared.LOCK_TIMEOUT_MS // 500):
+            await asyncio.sleep(0.5)
+            if await _load_shared_recipes(collection, version):
+                return
+
+            # the other worker may have failed
+            if locked := await shared.acquire_fetch_lock(collection):
+                break
+
+    try:
+        await _fetch_repository_recipes(collection, version)
+    finally:
+        if locked:
+            await shared.release_fetch_lock(collection)
+
+
+async def _fetch_repository_recipes(collection: str, version: int):
+    """ Retrieve a collection from the repository into the cache """
+    col = _get_collection(collection)
+    logger.info(f"Retrieving collection {collection}")
+    result = await _STORE.fetch(collection, col)
+
+    if col.version != version:
+        # the collection was changed locally while retrieving it,
+        # the retrieved collection is outdated
+        logger.info(f"Discarding retrieved collection {collection}, it changed while retrieving")
+        return
+
+    col.etag = result.etag
+    if result.recipes is None:
+        logger.info(f"Collection {collection} not modified")
         col.reset_timeout()
-        return col
+        await _store_recipes(collection, None)
+        return
+
+    # load the recipes
+    data = result.data or encode_recipes(result.recipes)
+    col.sha = result.sha
+    col.blobs = result.blobs
+    col.load(result.recipes)
+    col.reset_timeout()
+    _annotate_recipes(collection)
+    await _store_recipes(collection, data)
+
+
+async def _sync_steps(collection: str):
+    """ Annotate the steps of the recipes in a collection,
+    until they are in sync with the collection """
+    col = _get_collection(collection)
+    try:
+        while not col.steps_synced and col.recipes is not None:
+            col.steps_synced = True
+            await col.steps.sync(dict(col.recipes))
+    except Exception as e:
+        logger.exception(f"Failed to annotate collection {collection}: {e}")
+    finally:
+        col.steps_task = None
+
+
+def _annotate_recipes(collection: str):
+    """ Start annotating the changed recipes of a collection in the background """
+    col = _get_collection(collection)
+    if col.steps_task is None:
+        col.steps_task = asyncio.create_task(_sync_steps(collection))
 
 
 async def get_collection_etag(collection: str) -> str:
     """ Get the current file sha for a collection """
-    return (await _get_recipes(collection)).sha
+    col = await _get_recipes(collection)
+    if col.pending:
+        # the cached collection differs from the pushed one
+        return f"{col.sha}-{col.version}"
+    return col.sha
 
 async def get_recipes(collection: str) -> dict[str, Recipe]:
     """ Get the (possibly cached) recipes for a collection """
     return (await _get_recipes(collection)).recipes
 
 
+async def get_collection_index(collection: str) -> CollectionIndex:
+    """ Get the (possibly cached) indexes for a collection """
+    return (await _get_recipes(collection)).index
+
+
+async def search_recipes(collection: str, query: str, limit: int = 20, prefix: bool = False) -> list[tuple[str, float]]:
+    """ Search a collection, get the best matching recipe ids with their scores """
+    return (await _get_recipes(collection)).search.search(query, limit=limit, prefix=prefix)
+
+
+async def match_ingredients(collection: str, ingredients: list[str], limit: int = 20) -> list[tuple[str, float, int]]:
+    """ Get the recipes in a collection that can be made with the most of the given ingredients,
+    as (recipe id, fraction of its ingredients given, number of ingredients given) """
+    return (await _get_recipes(collection)).ingredients.match(ingredients, limit=limit)
+
+
+async def get_recipe_steps(collection: str, recipe_id: str) -> list[str]:
+    """ Get the steps of a recipe, annotated with ingredient references """
+    col = await _get_recipes(collection)
+    return col.steps.get(recipe_id, col.recipes[recipe_id])
+
+
 def _generate_key(recipes) -> str:
     """ Generate a key for a new recipe """ 
     while True:
@@ -135,45 +443,234 @@ def _generate_key(recipes) -> str:
             return key
 
 
-async def _push_recipes(collection: str, message: str):
-    """ Push an updated collection to the repository
-    with a given message """
+async def _push_recipes(collection: str, changes: dict[str, Recipe | None], message: str):
+    """ Push an updated collection to the repository with a given message.
+    The changed recipes (None for deleted recipes) are already in the cache. """
     logger.info(f"Pushing collection {collection}")
     col = _get_collection(collection)
 
-    async with aiohttp.ClientSession() as session:
-        # encode and format collection
-        data = msgspec.json.encode(col.asdict(), order='sorted')
-        formatted = msgspec.json.format(data, indent=2)
-
-        # execute push
-        res = await session.put(
-            f"https://api.github.com/repos/{RECIPE_REPO_USER}/{RECIPE_REPO_NAME}/contents/{collection}.json",
-            data=msgspec.json.encode({
-                "message": message,
-                "content": base64.b64encode(formatted).decode("ascii"),
-                "committer": {
-                    "name": "Master Chef",
-                    "email": "robot@masterchef.com"
-                },
-                "sha": col.sha
-            }),
-            headers={
-                "accept": "application/vnd.github+json",
-                "authorization": f"token {RECIPE_PAT}"
-            }
+    # discard refreshes that started before this push
+    col.version += 1
+
+    result = await _STORE.push(collection, col, changes, message)
+
+    # update cache SHA, the ETag of the old file is no longer valid
+    col.sha = result.sha
+    col.blobs = result.blobs
+    col.etag = None
+
+    # reset timeout on successful push, and discard
+    # refreshes that started during the push
+    col.version += 1
+    col.reset_timeout()
+
+    # share the pushed collection with the other workers, the cached
+    # collection is only the pushed one if no changes were queued meanwhile
+    data = result.data
+    if data is None and all(key in changes and changes[key] is recipe for key, recipe in col.pending.items()):
+        data = encode_recipes(col.recipes)
+    if data is not None:
+        await _store_recipes(collection, data)
+    await shared.publish_invalidation(collection, col.sha)
+    for callback in _PUSH_CALLBACKS:
+        await callback(collection, list(changes))
+
+
+def _commit_message(collection: str, messages: list[str]) -> str:
+    if len(messages) == 1:
+        return messages[0]
+    return f"Apply {len(messages)} changes in {collection}\n\n" + "\n".join(messages)
+
+
+async def _push_pending(collection: str):
+    """ Push the pending changes of a collection in a single commit """
+    # changes kept by a stopped worker are pushed before the collection is loaded
+    col = await _get_recipes(collection)
+    changes = dict(col.pending)
+    messages = list(col.pending_messages)
+
+    await _push_recipes(collection, changes, _commit_message(collection, messages))
+
+    # keep the changes that were queued during the push
+    for key, recipe in changes.items():
+        if col.pending.get(key) is recipe:
+            del col.pending[key]
+            del col.pending_base[key]
+        elif key in col.pending:
+            col.pending_base[key] = recipe
+    del col.pending_messages[:len(messages)]
+
+
+async def _attempt_push(collection: str):
+    """ Push the pending changes, the push is finished if the caller is cancelled """
+    col = _get_collection(collection)
+    if col.push_attempt is None:
+        col.push_attempt = asyncio.create_task(_push_pending(collection))
+    try:
+        await asyncio.shield(col.push_attempt)
+    finally:
+        if col.push_attempt.done():
+            col.push_attempt = None
+
+
+async def _flush_pending(collection: str):
+    """ Push the pending changes of a collection after the push delay,
+    until there are no more pending changes """
+    col = _get_collection(collection)
+    delay = RECIPE_PUSH_DELAY
+    attempt = 0
+    try:
+        while col.pending:
+            await asyncio.sleep(delay.total_seconds())
+            try:
+                await _attempt_push(collection)
+                delay = RECIPE_PUSH_DELAY
+                attempt = 0
+                continue
+            except RecipeConflictError as e:
+                logger.info(f"Collection {collection} changed in the repository, merging: {e}")
+            except (CookbookError, aiohttp.ClientError) as e:
+                log = logger.error if attempt >= RECIPE_PUSH_RETRIES else logger.warning
+                log(f"Failed to push {len(col.pending)} changes in collection {collection} (attempt {attempt + 1}): {e}")
+
+            # refetch the collection from the repository (the shared cache may
+            # be outdated), the pending changes are merged into it
+            attempt += 1
+            delay = min(RECIPE_PUSH_DELAY * 2 ** min(attempt, 16), RECIPE_PUSH_MAX_DELAY)
+            try:
+                await _fetch_repository_recipes(collection, col.version)
+            except (CookbookError, aiohttp.ClientError) as e:
+                logger.warning(f"Failed to refetch collection {collection}: {e}")
+    finally:
+        col.push_task = None
+
+
+def _queue_push(collection: str, changes: dict[str, Recipe | None], message: str):
+    """ Apply changes to the cache, and queue them to be pushed """
+    col = _get_collection(collection)
+    col.apply(changes)
+    col.pending_messages.append(message)
+    _annotate_recipes(collection)
+
+    # discard refreshes that started before this change
+    col.version += 1
+    if col.push_task is None:
+        col.push_task = asyncio.create_task(_flush_pending(collection))
+
+
+async def _on_invalidation(collection: str, sha: str):
+    """ Another worker pushed a collection, refresh ours """
+    if collection not in COLLECTIONS:
+        return
+
+    col = _get_collection(collection)
+    if col.sha == sha:
+        # we pushed this one ourselves
+        return
+
+    logger.info(f"Collection {collection} was changed by another worker")
+    col.recipe_timeout = None
+    _refresh_recipes(collection)
+
+
+async def _load_snapshot(collection: str):
+    """ Load the snapshot of a collection into the cache. The collection
+    is served right away, and revalidated in the background. """
+    col = _get_collection(collection)
+    snap = await snapshot.read_snapshot(collection)
+    if snap is None or col.is_loaded():
+        return
+
+    logger.info(f"Loading collection {collection} from snapshot")
+    try:
+        col.load(decode_recipes(snap.data))
+    except (msgspec.DecodeError, TypeError, ValueError) as e:
+        logger.warning(f"Invalid snapshot of collection {collection}: {e}")
+        return
+    col.sha = snap.sha
+    col.etag = snap.etag
+    _annotate_recipes(collection)
+    col.reset_timeout()
+    col.recipe_timeout = None
+    _refresh_recipes(collection)
+
+
+def on_push(callback: Callable[[str, list[str]], Awaitable[None]]):
+    """ Call callback(collection, recipe ids) after changes to a collection are pushed """
+    _PUSH_CALLBACKS.append(callback)
+
+
+async def init_cookbook(app: 'Sanic', loop):
+    """ Load collection snapshots, and start listening
+    for collections changed by other workers """
+    for collection in COLLECTIONS:
+        await _restore_pending(collection)
+        await _load_snapshot(collection)
+    app.add_task(shared.listen_invalidations(_on_invalidation), name="collection_invalidations")
+
+
+async def _restore_pending(collection: str):
+    """ Queue the changes a stopped worker could not push """
+    col = _get_collection(collection)
+    for pending in await snapshot.take_pending(collection):
+        logger.info(f"Restoring {len(pending.changes)} pending changes in collection {collection}")
+        for recipe_id, data in pending.changes.items():
+            if recipe_id not in col.pending:
+                base = pending.base[recipe_id]
+                col.pending_base[recipe_id] = decode_recipe(base) if base is not None else None
+            col.pending[recipe_id] = decode_recipe(data) if data is not None else None
+        col.pending_messages.extend(pending.messages)
+
+    if col.pending and col.push_task is None:
+        col.push_task = asyncio.create_task(_flush_pending(collection))
+
+
+async def _keep_pending(collection: str):
+    """ Keep the changes that could not be pushed for the next worker """
+    col = _get_collection(collection)
+    pending = snapshot.PendingChanges(
+        changes={
+            recipe_id: encode_recipe(recipe) if recipe is not None else None
+            for recipe_id, recipe in col.pending.items()
+        },
+        base={
+            recipe_id: encode_recipe(recipe) if recipe is not None else None
+            for recipe_id, recipe in col.pending_base.items()
+        },
+        messages=list(col.pending_messages)
+    )
+    if await snapshot.write_pending(collection, pending):
+        logger.warning(f"Kept {len(col.pending)} changes in collection {collection} to push on the next start")
+    else:
+        logger.error(
+            f"Lost {len(col.pending)} changes in collection {collection}:\n" + "\n".join(col.pending_messages)
         )
 
-        # update cache SHA
-        commit = await res.json()
-        col.sha = commit["content"]["sha"]
 
-        if not res.ok:
-            col.clear()
-            raise CookbookError(f"Error pushing recipe: {res.status} ({await res.text()})")
-        
-        # reset timeout on successful push
-        col.reset_timeout()
+async def _push_remaining(collection: str):
+    """ Finish the push in flight, and push the changes queued during it """
+    col = _get_collection(collection)
+    while col.pending:
+        await _attempt_push(collection)
+
+
+async def close_cookbook(app: 'Sanic', loop):
+    """ Push the pending changes right away, and keep the ones that cannot be pushed """
+    for collection in COLLECTIONS:
+        col = _get_collection(collection)
+        if col.push_task is not None:
+            # stops waiting between attempts, a push in flight is finished
+            col.push_task.cancel()
+        if col.pending:
+            try:
+                await asyncio.wait_for(_push_remaining(collection), RECIPE_CLOSE_TIMEOUT.total_seconds())
+            except asyncio.TimeoutError:
+                logger.error(f"Timed out pushing collection {collection}")
+            except (CookbookError, aiohttp.ClientError) as e:
+                logger.error(f"Failed to push collection {collection}: {e}")
+        if col.pending:
+            await _keep_pending(collection)
+
 
 async def add_recipe(collection: str, recipe: Recipe):
     """ Add recipe to collection by name """
@@ -183,11 +680,11 @@ async def add_recipe(collection: str, recipe: Recipe):
         date_created=recipe.date_created or now,
         date_updated=now
     )
-    col = await _get_recipes(collection)
+    col = await _get_recipes(collection, allow_stale=False)
     key = _generate_key(col.recipes)
-    col.recipes[key] = recipe
-    await _push_recipes(
-        collection, 
+    _queue_push(
+        collection,
+        {key: recipe},
         f"Add recipe {recipe.name} in {collection}"
     )
     return key
@@ -195,7 +692,7 @@ async def add_recipe(collection: str, recipe: Recipe):
 
 async def update_recipe(collection: str, key: str, recipe: Recipe):
     """ Update recipe in collection by name and ID """
-    col = await _get_recipes(collection)
+    col = await _get_recipes(collection, allow_stale=False)
     if key not in col.recipes:
         raise CookbookError(f"Cannot update recipe with id {key} in collection {collection}, as it does not exist")
 
@@ -214,9 +711,9 @@ async def update_recipe(collection: str, key: str, recipe: Recipe):
         return
 
     # replace recipe in collection
-    col.recipes[key] = new_recipe
-    await _push_recipes(
-        collection, 
+    _queue_push(
+        collection,
+        {key: new_recipe},
         f"Update recipe {new_recipe.name} in {collection}"
     )
     return key
@@ -224,11 +721,12 @@ async def update_recipe(collection: str, key: str, recipe: Recipe):
 
 async def delete_recipe(collection: str, key: str):
     """ Remove recipe from collection """
-    col = await _get_recipes(collection)
-    recipe = col.recipes.pop(key)
+    col = await _get_recipes(collection, allow_stale=False)
+    recipe = col.recipes[key]
 
-    await _push_recipes(
-        collection, 
+    _queue_push(
+        collection,
+        {key: None},
         f"Delete recipe {recipe.name} in {collection}"
     )
     return recipe
\ No newline at end of file
@@ -0,0 +1,333 @@
+""" Storage of recipe collections in a GitHub repository.
+
+Two layouts are supported:
+- file: a single {collection}.json file per collection
+- tree: a {collection}/ directory with a {recipe_id}.json file per recipe.
+  The git tree of the directory is the index of the collection, so edits
+  only upload the recipes that changed, and reads only download changed
+  recipes. A collection still stored as a single file is read from that
+  file, and migrated to a directory on the first push.
+"""
+
+import asyncio
+import base64
+import hashlib
+import logging
+import os
+
+import aiohttp
+import msgspec.json
+
+from .recipe import Recipe
+from .schema import decode_recipe, decode_recipes, encode_recipe, encode_recipes
+from .store import RecipeStore, FetchResult, PushResult
+from .utils import CookbookError, RecipeConflictError
+
+from typing import TYPE_CHECKING
+if TYPE_CHECKING:
+    from .cookbook import CollectionCache
+
+logger = logging.getLogger(__name__)
+
+RECIPE_REPO_USER = os.environ["RECIPE_REPO_USER"]
+RECIPE_REPO_NAME = os.environ["RECIPE_REPO_NAME"]
+RECIPE_PAT = os.environ["RECIPE_PAT"]
+
+_REPO_URL = f"https://api.github.com/repos/{RECIPE_REPO_USER}/{RECIPE_REPO_NAME}"
+_GRAPHQL_URL = "https://api.github.com/graphql"
+_COMMITTER = {
+    "name": "Master Chef",
+    "email": "robot@masterchef.com"
+}
+
+# number of recipe files to retrieve in a single query
+BLOB_BATCH_SIZE = 100
+
+_EMPTY_TREE_SHA = "4b825dc642cb6eb9a060e54bf8d69288fbee4904"
+
+
+def _headers(**extra) -> dict[str, str]:
+    return {
+        "accept": "application/vnd.github+json",
+        "authorization": f"token {RECIPE_PAT}",
+        **extra
+    }
+
+
+def _blob_sha(content: bytes) -> str:
+    """ Git blob sha of a file, so we do not need to retrieve it after pushing """
+    return hashlib.sha1(b"blob %d\0" % len(content) + content, usedforsecurity=False).hexdigest()
+
+
+async def _request(session: aiohttp.ClientSession, method: str, url: str, **kwargs) -> aiohttp.ClientResponse:
+    try:
+        return await session.request(method, url, **kwargs)
+    except aiohttp.ClientConnectionError:
+        raise CookbookError(f"Error accessing recipes: failed to connect")
+
+
+async def _graphql(session: aiohttp.ClientSession, query: str, **variables) -> dict:
+    res = await _request(
+        session, "POST", _GRAPHQL_URL,
+        data=msgspec.json.encode({"query": query, "variables": variables}),
+        headers=_headers()
+    )
+    if not res.ok:
+        raise CookbookError(f"Error getting recipes: {res.status} ({await res.text()})")
+
+    result = msgspec.json.decode(await res.read())
+    if result.get("errors"):
+        raise CookbookError(f"Error getting recipes: {result['errors']}")
+    return result["data"]["repository"]
+
+
+class FileLayout(RecipeStore):
+    """ Collections stored in a single {collection}.json file """
+
+    async def fetch(self, collection: str, col: 'CollectionCache') -> FetchResult:
+        headers = _headers()
+        if col.is_loaded() and col.etag is not None:
+            # only download the file if it changed since the last retrieval
+            # not modified responses do not count towards the rate limit
+            headers["if-none-match"] = col.etag
+
+        async with aiohttp.ClientSession() as session:
+            # use GitHub API, as the repo may be private
+            res = await _request(session, "GET", f"{_REPO_URL}/contents/{collection}.json", headers=headers)
+            if res.status == 304:
+                return FetchResult(sha=col.sha, etag=col.etag)
+            if not res.ok:
+                raise CookbookError(f"Error getting recipes: {res.status} ({await res.text()})")
+
+            file = await res.json()
+
+        etag = res.headers.get("ETag")
+        if col.is_loaded() and file["sha"] == col.sha:
+            # same file contents, no need to decode them again
+            return FetchResult(sha=col.sha, etag=etag)
+
+        data = base64.b64decode(file["content"])
+        return FetchResult(sha=file["sha"], etag=etag, recipes=decode_recipes(data), data=data)
+
+    async def push(self, collection: str, col: 'CollectionCache', changes: dict[str, Recipe | None],
+                   message: str) -> PushResult:
+        formatted = encode_recipes(col.recipes)
+
+        async with aiohttp.ClientSession() as session:
+            res = await _request(
+                session, "PUT", f"{_REPO_URL}/contents/{collection}.json",
+                data=msgspec.json.encode({
+                    "message": message,
+                    "content": base64.b64encode(formatted).decode("ascii"),
+                    "committer": _COMMITTER,
+                    "sha": col.sha
+                }),
+                headers=_headers()
+            )
+
+            if res.status in (409, 422):
+                # the file sha does not match, the file changed since we retrieved it
+                raise RecipeConflictError(f"Error pushing recipe: {res.status} ({await res.text()})")
+            if not res.ok:
+                raise CookbookError(f"Error pushing recipe: {res.status} ({await res.text()})")
+            commit = await res.json()
+
+        return PushResult(sha=commit["content"]["sha"], data=formatted)
+
+
+_TREE_QUERY = """
+query($owner: String!, $name: String!, $expression: String!) {
+  repository(owner: $owner, name: $name) {
+    object(expression: $expression) {
+      ... on Tree { oid entries { name oid } }
+    }
+  }
+}
+"""
+
+_HEAD_QUERY = """
+query($owner: String!, $name: String!, $file: String!, $directory: String!) {
+  repository(owner: $owner, name: $name) {
+    defaultBranchRef {
+      name
+      target { ... on Commit { oid tree { oid } } }
+    }
+    file: object(expression: $file) { oid }
+    directory: object(expression: $directory) {
+      oid
+      ... on Tree { entries { name oid } }
+    }
+  }
+}
+"""
+
+
+class TreeLayout(RecipeStore):
+    """ Collections stored as a {collection}/ directory with a file per recipe """
+
+    def __init__(self):
+        self.legacy = FileLayout()
+
+    async def _fetch_blobs(self, session: aiohttp.ClientSession, oids: list[str]) -> list[bytes]:
+        """ Retrieve the contents of the given blobs in batched queries """
+
+        async def _fetch_batch(batch: list[str]) -> list[bytes]:
+            # object ids are hex strings from the GitHub API, safe to inline
+            fields = "\n".join(
+                f'b{i}: object(oid: "{oid}") {{ ... on Blob {{ text }} }}'
+                for i, oid in enumerate(batch)
+            )
+            repository = await _graphql(
+                session,
+                f"query($owner: String!, $name: String!) {{ repository(owner: $owner, name: $name) {{ {fields} }} }}",
+                owner=RECIPE_REPO_USER, name=RECIPE_REPO_NAME
+            )
+            return [repository[f"b{i}"]["text"].encode("utf-8") for i in range(len(batch))]
+
+        batches = await asyncio.gather(*(
+            _fetch_batch(oids[i:i + BLOB_BATCH_SIZE])
+            for i in range(0, len(oids), BLOB_BATCH_SIZE)
+        ))
+        return [blob for batch in batches for blob in batch]
+
+    async def fetch(self, collection: str, col: 'CollectionCache') -> FetchResult:
+        async with aiohttp.ClientSession() as session:
+            repository = await _graphql(
+                session, _TREE_QUERY,
+                owner=RECIPE_REPO_USER, name=RECIPE_REPO_NAME,
+                expression=f"HEAD:{collection}"
+            )
+            tree = repository["object"]
+            if tree is None:
+                # collection was not migrated yet
+                logger.info(f"Collection {collection} is stored as a single file")
+                return await self.legacy.fetch(collection, col)
+
+            if col.is_loaded() and tree["oid"] == col.sha:
+                return FetchResult(sha=col.sha, etag=None, blobs=col.blobs)
+
+            # only retrieve the recipes that changed
+            # pending changes are not in the repository, retrieve those recipes as well
+            known = {
+                recipe_id: oid for recipe_id, oid in col.blobs.items()
+                if recipe_id not in col.pending
+            } if col.is_loaded() and col.blobs is not None else {}
+            blobs = {
+                entry["name"].removesuffix(".json"): entry["oid"]
+                for entry in tree["entries"]
+                if entry["name"].endswith(".json")
+            }
+            changed = [recipe_id for recipe_id, oid in blobs.items() if known.get(recipe_id) != oid]
+            logger.info(f"Retrieving {len(changed)}/{len(blobs)} recipes in collection {collection}")
+            contents = await self._fetch_blobs(session, [blobs[recipe_id] for recipe_id in changed])
+
+        recipes = {
+            recipe_id: col.recipes[recipe_id]
+            for recipe_id in blobs
+            if recipe_id in known and known[recipe_id] == blobs[recipe_id]
+        }
+        for recipe_id, content in zip(changed, contents):
+            recipes[recipe_id] = decode_recipe(content)
+
+        return FetchResult(sha=tree["oid"], etag=None, recipes=recipes, blobs=blobs)
+
+    async def push(self, collection: str, col: 'CollectionCache', changes: dict[str, Recipe | None],
+                   message: str) -> PushResult:
+        async with aiohttp.ClientSession() as session:
+            repository = await _graphql(
+                session, _HEAD_QUERY,
+                owner=RECIPE_REPO_USER, name=RECIPE_REPO_NAME,
+                file=f"HEAD:{collection}.json",
+                directory=f"HEAD:{collection}"
+            )
+            head = repository["defaultBranchRef"]
+            directory = repository["directory"]
+            file = repository["file"]
+
+            # the collection is the directory, or the single file if it was not migrated yet
+            # git does not store empty directories, use the empty tree sha for those
+            if directory is not None:
+                current = directory["oid"]
+            else:
+                current = file["oid"] if file is not None else _EMPTY_TREE_SHA
+            if current != col.sha:
+                raise RecipeConflictError(f"Error pushing recipe: collection {collection} changed")
+
+            if directory is not None:
+                # the recipe files of the collection we retrieved, the cache
+                # may not know them (loaded from the shared cache or a snapshot)
+                blobs = {
+                    entry["name"].removesuffix(".json"): entry["oid"]
+                    for entry in directory["entries"]
+                    if entry["name"].endswith(".json")
+                }
+            else:
+                blobs = {}
+            if file is not None:
+                # migrate a single file collection: write all recipes, remove the old file
+                logger.info(f"Migrating collection {collection} to a file per recipe")
+                changes = {**col.recipes, **changes}
+
+            entries = []
+            if file is not None:
+                entries.append({"path": f"{collection}.json", "mode": "100644", "type": "blob", "sha": None})
+            for recipe_id, recipe in changes.items():
+                path = f"{collection}/{recipe_id}.json"
+                if recipe is None:
+                    # recipes without a file have nothing to delete
+                    if blobs.pop(recipe_id, None) is not None:
+                        entries.append({"path": path, "mode": "100644", "type": "blob", "sha": None})
+                else:
+                    content = encode_recipe(recipe)
+                    blobs[recipe_id] = _blob_sha(content)
+                    entries.append({"path": path, "mode": "100644", "type": "blob", "content": content.decode("utf-8")})
+
+            # create a new tree on top of the current one, and commit it
+            res = await _request(
+                session, "POST", f"{_REPO_URL}/git/trees",
+                data=msgspec.json.encode({"base_tree": head["target"]["tree"]["oid"], "tree": entries}),
+                headers=_headers()
+            )
+            if not res.ok:
+                raise CookbookError(f"Error pushing recipe: {res.status} ({await res.text()})")
+            tree = await res.json()
+
+            res = await _request(
+                session, "POST", f"{_REPO_URL}/git/commits",
+                data=msgspec.json.encode({
+                    "message": message,
+                    "tree": tree["sha"],
+                    "parents": [head["target"]["oid"]],
+                    "committer": _COMMITTER
+                }),
+                headers=_headers()
+            )
+            if not res.ok:
+                raise CookbookError(f"Error pushing recipe: {res.status} ({await res.text()})")
+            commit = await res.json()
+
+            # move the branch to the new commit, this fails if
+            # the branch moved since we retrieved it
+            res = await _request(
+                session, "PATCH", f"{_REPO_URL}/git/refs/heads/{head['name']}",
+                data=msgspec.json.encode({"sha": commit["sha"], "force": False}),
+                headers=_headers()
+            )
+            if res.status in (409, 422):
+                raise RecipeConflictError(f"Error pushing recipe: {res.status} ({await res.text()})")
+            if not res.ok:
+                raise CookbookError(f"Error pushing recipe: {res.status} ({await res.text()})")
+
+        # the collection sha is the sha of its directory
+        # git does not store empty directories, use the empty tree sha for those
+        sha = next(
+            (entry["sha"] for entry in tree["tree"] if entry["path"] == collection),
+            _EMPTY_TREE_SHA
+        )
+        return PushResult(sha=sha, blobs=blobs)
+
+
+LAYOUTS = {
+    "file": FileLayout,
+    "tree": TreeLayout,
+}
@@ -0,0 +1,71 @@
+""" Precomputed orderings and tag indexes of a recipe collection,
+so rendering a collection does not need to sort it on every request """
+
+from collections import defaultdict
+
+from .recipe import Recipe
+
+# RecipeMeta fields that recipes can be filtered on
+TAG_FIELDS = (
+    "meal_type",
+    "meat_type",
+    "carb_type",
+    "cuisine",
+    "temperature",
+    "language",
+)
+
+
+class CollectionIndex:
+
+    """ Indexes of a collection, built once per change of the collection """
+
+    def __init__(self, recipes: dict[str, Recipe]):
+        # recipe ids, most recent first, then most recently updated and by id,
+        # so the position of a recipe follows from its dates and id alone
+        self.by_updated: list[str] = sorted(
+            recipes, key=lambda recipe_id: (recipes[recipe_id].date_updated, recipe_id), reverse=True
+        )
+        self.by_created: list[str] = sorted(
+            recipes, key=lambda recipe_id: (recipes[recipe_id].date_created, recipes[recipe_id].date_updated, recipe_id), reverse=True
+        )
+
+        # recipes in the default ordering (most recently updated first)
+        self.ordered: dict[str, Recipe] = {recipe_id: recipes[recipe_id] for recipe_id in self.by_updated}
+        self.latest: str | None = max(recipes, key=lambda recipe_id: recipes[recipe_id].date_created, default=None)
+
+        # recipe ids per value of each tag field
+        tags = {field: defaultdict(set) for field in TAG_FIELDS}
+        for recipe_id, recipe in recipes.items():
+            for field in TAG_FIELDS:
+                values = getattr(recipe.meta, field)
+                if not isinstance(values, list):
+                    values = [values]
+                for value in values:
+                    if value is not None:
+                        tags[field][value].add(recipe_id)
+
+        self.tags: dict[str, dict[str, frozenset[str]]] = {
+            field: {value: frozenset(recipe_ids) for value, recipe_ids in index.items()}
+            for field, index in tags.items()
+        }
+
+    def __len__(self):
+        return len(self.by_updated)
+
+    def tagged(self, field: str, value: str) -> frozenset[str]:
+        """ Get the ids of the recipes with a tag """
+        return self.tags[field].get(value, frozenset())
+
+    def filtered(self, filters: dict[str, list[str]]) -> frozenset[str] | None:
+        """ Get the ids of the recipes matching any of the values for every
+        field in filters, or None if there are no filters """
+        result = None
+        for field, values in filters.items():
+            matches = frozenset().union(*(self.tagged(field, value) for value in values))
+            result = matches if result is None else result & matches
+        return result
+
+    def ordering(self, sort: str) -> list[str]:
+        """ Get the recipe ids by date "updated" or "created" """
+        return self.by_updated if sort == "updated" else self.by_created
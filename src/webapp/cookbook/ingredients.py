@@ -0,0 +1,138 @@
+""" Index of the ingredients used in a collection, for finding
+the recipes that can be made with a set of ingredients.
+
+Ingredients are normalized like ingredient references, and split into
+stemmed words. Words of a query are matched to the words used in the
+collection exactly, or through a trigram index, which allows for typos. """
+
+from collections import defaultdict
+
+from rapidfuzz import fuzz
+
+from .recipe import Recipe
+from .references import _process_string
+from .search import _stems
+
+# minimum similarity of a word with a typo
+WORD_THRESHOLD = 80
+# minimum fraction of shared trigrams of a word with a typo
+TRIGRAM_THRESHOLD = 0.3
+
+
+def _trigrams(word: str) -> set[str]:
+    word = f"  {word} "
+    return {word[i:i + 3] for i in range(len(word) - 2)}
+
+
+def _ingredient_words(ingredient: str) -> frozenset[str]:
+    return frozenset(
+        stem
+        for word in _process_string(ingredient).split(" ") if word
+        for stem in _stems(word, None)
+    )
+
+
+class IngredientIndex:
+
+    """ Ingredient words of the recipes of a collection """
+
+    def __init__(self):
+        self.recipes: dict[str, Recipe] = {}  # indexed recipes
+        self.words: dict[str, set[str]] = {}  # word -> recipe ids
+        self.trigrams: dict[str, set[str]] = defaultdict(set)  # trigram -> words
+
+        # words of every ingredient per recipe
+        self.ingredients: dict[str, list[frozenset[str]]] = {}
+
+    def _remove(self, recipe_id: str):
+        del self.recipes[recipe_id]
+        for word in frozenset().union(*self.ingredients.pop(recipe_id)):
+            recipe_ids = self.words[word]
+            recipe_ids.discard(recipe_id)
+            if not recipe_ids:
+                del self.words[word]
+                for trigram in _trigrams(word):
+                    self.trigrams[trigram].discard(word)
+
+    def _add(self, recipe_id: str, recipe: Recipe):
+        self.recipes[recipe_id] = recipe
+        self.ingredients[recipe_id] = [
+            _ingredient_words(ingredient.ingredient)
+            for ingredient in recipe.ingredients
+            # skip headers
+            if not ingredient.ingredient.startswith("#")
+        ]
+        for word in frozenset().union(*self.ingredients[recipe_id]):
+            if word not in self.words:
+                self.words[word] = set()
+                for trigram in _trigrams(word):
+                    self.trigrams[trigram].add(word)
+            self.words[word].add(recipe_id)
+
+    def sync(self, recipes: dict[str, Recipe]):
+        """ Update the index to a collection, only reindexing the recipes that changed """
+        for recipe_id in [recipe_id for recipe_id in self.recipes if recipe_id not in recipes]:
+            self._remove(recipe_id)
+
+        for recipe_id, recipe in recipes.items():
+            indexed = self.recipes.get(recipe_id)
+            if indexed is recipe:
+                continue
+            if indexed is not None:
+                self._remove(recipe_id)
+            self._add(recipe_id, recipe)
+
+    def _match_word(self, word: str) -> set[str]:
+        """ Words in the collection that match a (stemmed) query word """
+        if word in self.words:
+            return {word}
+
+        trigrams = _trigrams(word)
+        shared = defaultdict(int)
+        for trigram in trigrams:
+            for candidate in self.trigrams.get(trigram, ()):
+                shared[candidate] += 1
+
+        return {
+            candidate for candidate, count in shared.items()
+            if count / len(trigrams | _trigrams(candidate)) >= TRIGRAM_THRESHOLD
+            and fuzz.ratio(word, candidate, score_cutoff=WORD_THRESHOLD)
+        }
+
+    def match(self, ingredients: list[str], limit: int = 20) -> list[tuple[str, float, int]]:
+        """ Get the recipes that use the most of the given ingredients, as
+        (recipe id, fraction of its ingredients given, number of ingredients
+        given), best first """
+        # every query ingredient as a list of alternatives per word
+        queries = []
+        for ingredient in ingredients:
+            words = [
+                set().union(*(self._match_word(stem) for stem in _stems(word, None)))
+                for word in _process_string(ingredient).split(" ") if word
+            ]
+            if words and all(words):
+                queries.append(words)
+
+        # recipes with all words of a query ingredient
+        candidates = set()
+        for words in queries:
+            candidates |= set.intersection(*(
+                set().union(*(self.words[word] for word in alternatives))
+                for alternatives in words
+            ))
+
+        matched = set().union(*(alternatives for words in queries for alternatives in words))
+        results = []
+        for recipe_id in candidates:
+            covered = 0
+            for recipe_ingredient in self.ingredients[recipe_id]:
+                if recipe_ingredient.isdisjoint(matched):
+                    continue
+                # all words of a query ingredient occur in the recipe ingredient
+                if any(all(not alternatives.isdisjoint(recipe_ingredient) for alternatives in words) for words in queries):
+                    covered += 1
+            if covered:
+                results.append((recipe_id, covered / len(self.ingredients[recipe_id]), covered))
+
+        results.sort(key=lambda result: (result[1], result[2]), reverse=True)
+        return results[:limit]
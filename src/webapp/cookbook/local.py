@@ -0,0 +1,174 @@
+""" Local storage of recipe collections in an SQLite database, with a row per recipe.
+
+Avoids the round trips to GitHub, and allows running (or load testing)
+without network access. A collection file can be imported with
+    python -m cookbook.local <collection> <file.json>
+"""
+
+import asyncio
+import hashlib
+import logging
+import os
+import sqlite3
+import sys
+
+from .recipe import Recipe
+from .schema import decode_recipe, decode_recipes, encode_recipe
+from .store import RecipeStore, FetchResult, PushResult
+from .utils import RecipeConflictError
+
+from typing import TYPE_CHECKING
+if TYPE_CHECKING:
+    from .cookbook import CollectionCache
+
+logger = logging.getLogger(__name__)
+
+RECIPE_DB = os.getenv("RECIPE_DB") or os.path.join(os.getenv("PERSIST_DIR", "."), "recipes.db")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS collections (
+    name TEXT PRIMARY KEY,
+    version INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS recipes (
+    collection TEXT NOT NULL,
+    recipe_id TEXT NOT NULL,
+    sha TEXT NOT NULL,
+    data BLOB NOT NULL,
+    PRIMARY KEY (collection, recipe_id)
+) WITHOUT ROWID;
+"""
+
+
+def _sha(content: bytes) -> str:
+    return hashlib.sha1(content, usedforsecurity=False).hexdigest()
+
+
+class LocalStore(RecipeStore):
+    """ Collections stored in a local SQLite database """
+
+    def __init__(self, path: str = RECIPE_DB):
+        self.path = path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with self._connect() as db:
+            db.execute("PRAGMA journal_mode=WAL")
+            db.executescript(_SCHEMA)
+
+    def _connect(self) -> sqlite3.Connection:
+        # connections are not shared between threads, open one per operation
+        return sqlite3.connect(self.path, timeout=30, isolation_level=None)
+
+    @staticmethod
+    def _get_version(db: sqlite3.Connection, collection: str) -> int:
+        row = db.execute("SELECT version FROM collections WHERE name = ?", (collection,)).fetchone()
+        return row[0] if row is not None else 0
+
+    def _fetch(self, collection: str, sha: str | None,
+               known: dict[str, str]) -> tuple[str, dict[str, str] | None, dict[str, bytes]]:
+        with self._connect() as db:
+            db.execute("BEGIN")
+            version = str(self._get_version(db, collection))
+            if version == sha:
+                db.execute("COMMIT")
+                return version, None, {}
+
+            blobs = dict(db.execute(
+                "SELECT recipe_id, sha FROM recipes WHERE collection = ?", (collection,)
+            ).fetchall())
+
+            # only retrieve the recipes that changed
+            changed = [recipe_id for recipe_id, blob in blobs.items() if known.get(recipe_id) != blob]
+            contents = {}
+            for recipe_id in changed:
+                contents[recipe_id] = db.execute(
+                    "SELECT data FROM recipes WHERE collection = ? AND recipe_id = ?",
+                    (collection, recipe_id)
+                ).fetchone()[0]
+            db.execute("COMMIT")
+        return version, blobs, contents
+
+    async def fetch(self, collection: str, col: 'CollectionCache') -> FetchResult:
+        loaded = col.is_loaded() and col.blobs is not None
+        sha, blobs, contents = await asyncio.to_thread(
+            self._fetch, collection,
+            col.sha if loaded else None,
+            # pending changes are not stored, retrieve those recipes as well
+            {
+                recipe_id: sha for recipe_id, sha in col.blobs.items()
+                if recipe_id not in col.pending
+            } if loaded else {}
+        )
+        if blobs is None:
+            return FetchResult(sha=sha, etag=None, blobs=col.blobs)
+
+        recipes = {
+            recipe_id: col.recipes[recipe_id] if recipe_id not in contents else decode_recipe(contents[recipe_id])
+            for recipe_id in blobs
+        }
+        return FetchResult(sha=sha, etag=None, recipes=recipes, blobs=blobs)
+
+    def _push(self, collection: str, rows: dict[str, tuple[str, bytes] | None], replace: bool,
+              sha: str | None = None) -> str:
+        with self._connect() as db:
+            db.execute("BEGIN IMMEDIATE")
+            if sha is not None and str(self._get_version(db, collection)) != sha:
+                db.execute("ROLLBACK")
+                raise RecipeConflictError(f"Error pushing recipe: collection {collection} changed")
+            if replace:
+                db.execute("DELETE FROM recipes WHERE collection = ?", (collection,))
+            for recipe_id, row in rows.items():
+                if row is None:
+                    db.execute(
+                        "DELETE FROM recipes WHERE collection = ? AND recipe_id = ?",
+                        (collection, recipe_id)
+                    )
+                else:
+                    db.execute(
+                        "INSERT INTO recipes (collection, recipe_id, sha, data) VALUES (?, ?, ?, ?) "
+                        "ON CONFLICT (collection, recipe_id) DO UPDATE SET sha = excluded.sha, data = excluded.data",
+                        (collection, recipe_id, *row)
+                    )
+            version = db.execute(
+                "INSERT INTO collections (name, version) VALUES (?, 1) "
+                "ON CONFLICT (name) DO UPDATE SET version = version + 1 RETURNING version",
+                (collection,)
+            ).fetchone()[0]
+            db.execute("COMMIT")
+        return str(version)
+
+    async def push(self, collection: str, col: 'CollectionCache', changes: dict[str, Recipe | None],
+                   message: str) -> PushResult:
+        blobs = dict(col.blobs) if col.blobs is not None else {}
+        replace = col.blobs is None
+        if replace:
+            # the stored rows are unknown (loaded from the shared cache or a snapshot),
+            # replace the whole collection
+            changes = dict(col.recipes)
+
+        rows = {}
+        for recipe_id, recipe in changes.items():
+            if recipe is None:
+                blobs.pop(recipe_id, None)
+                rows[recipe_id] = None
+            else:
+                content = encode_recipe(recipe)
+                blobs[recipe_id] = _sha(content)
+                rows[recipe_id] = (blobs[recipe_id], content)
+
+        logger.debug(f"{message} ({len(rows)} rows)")
+        sha = await asyncio.to_thread(self._push, collection, rows, replace, col.sha)
+        return PushResult(sha=sha, blobs=blobs)
+
+    def import_collection(self, collection: str, data: bytes):
+        """ Replace a collection by an encoded collection file """
+        rows = {}
+        for recipe_id, recipe in decode_recipes(data).items():
+            content = encode_recipe(recipe)
+            rows[recipe_id] = (_sha(content), content)
+        self._push(collection, rows, replace=True)
+
+
+if __name__ == '__main__':
+    _collection, _file = sys.argv[1:3]
+    with open(_file, "rb") as f:
+        LocalStore().import_collection(_collection, f.read())
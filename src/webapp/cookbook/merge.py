@@ -0,0 +1,45 @@
+""" Three-way merge of recipes that were changed both locally
+and in the repository since they were last retrieved. """
+
+import dataclasses
+import logging
+
+from .recipe import Recipe
+
+logger = logging.getLogger(__name__)
+
+_FIELDS = tuple(
+    field.name for field in dataclasses.fields(Recipe)
+    if field.name not in {"date_created", "date_updated"}
+)
+
+
+def merge_recipe(base: Recipe | None, ours: Recipe | None, theirs: Recipe | None) -> Recipe | None:
+    """ Merge a local change (ours) with the repository (theirs), both
+    starting from base. None means the recipe does not exist (anymore).
+    Fields changed on both sides keep the local value. """
+    if theirs == base:
+        # not changed in the repository
+        return ours
+    if ours == theirs:
+        return ours
+    if ours is None:
+        # deleted locally, but changed in the repository, keep the changes
+        logger.warning(f"Recipe {theirs.name} was changed in the repository, not deleting it")
+        return theirs
+    if theirs is None or base is None:
+        # deleted in the repository (keep ours), or added on both sides
+        return ours
+
+    merged = {}
+    for name in _FIELDS:
+        value = getattr(ours, name)
+        if value == getattr(base, name):
+            merged[name] = getattr(theirs, name)
+        elif getattr(theirs, name) != getattr(base, name) and getattr(theirs, name) != value:
+            logger.warning(f"Conflicting change to {name} of recipe {ours.name}, keeping the local change")
+    return dataclasses.replace(
+        ours,
+        **merged,
+        date_updated=max(ours.date_updated, theirs.date_updated)
+    )
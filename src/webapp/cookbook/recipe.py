@@ -1,13 +1,18 @@
 import abc
 import dataclasses
+import functools
 import hashlib
 import types
 import typing
+from collections.abc import Callable
 from dataclasses import dataclass, field
 from typing import Any
 
 import msgspec.json
+from rapidfuzz import fuzz as rfuzz
+from rapidfuzz import process as rprocess
 from thefuzz import process
+from thefuzz.utils import full_process
 
 from .meta import *
 
@@ -23,108 +28,172 @@ def _is_list_of_single_keyed_dicts(value: list) -> bool:
     return all(isinstance(v, dict) for v in value) and len({k for v in value for k in v}) == 1
 
 
+def _compile_converter(field_type) -> Callable[[Any], Any]:
+    """ Compile a converter that loosely parses values into field_type """
+    if isinstance(field_type, types.GenericAlias):
+        origin = typing.get_origin(field_type) or field_type
+        field_args = typing.get_args(field_type)
+
+        if origin is not list:
+            def _unsupported(value):
+                raise NotImplementedError(f"GenericAlias {field_type} loading")
+            return _unsupported
+
+        subscript, = field_args
+
+        # the subscript may be subscripted itself
+        subscript = typing.get_origin(subscript) or subscript
+
+        if issubclass(subscript, Fixable):
+            def _convert_element(v):
+                assert isinstance(v, dict)
+                return subscript.from_data(**v)
+        elif dataclasses.is_dataclass(subscript):
+            def _convert_element(v):
+                assert isinstance(v, dict)
+                return subscript(**v)
+        else:
+            _convert_element = subscript
+        unwrap_dicts = subscript is not dict and not issubclass(subscript, Fixable) \
+                       and not dataclasses.is_dataclass(subscript)
+
+        def _convert_list(value):
+            if not isinstance(value, list):
+                # make list of value
+                value = [value]
+
+            if unwrap_dicts and _is_list_of_single_keyed_dicts(value):
+                # all single-keyed dicts with the same key, take the value
+                # this fixes an issue where ChatGPT returns a list of
+                # {'step': 'step text'} dicts for the recipe steps
+                # instead of converting to subscript directly, we take the first
+                # (and only) dict value
+                return [subscript(next(iter(v.values()))) for v in value]
+
+            # initialize elementwise
+            return [_convert_element(v) for v in value]
+
+        return _convert_list
+
+    if issubclass(field_type, Fixable):
+        def _convert_value(value):
+            return field_type.from_data(**value)
+    elif dataclasses.is_dataclass(field_type):
+        def _convert_value(value):
+            return field_type(**value)
+    else:
+        _convert_value = field_type
+
+    def _convert(value):
+        # value may be a list, like in a form submission
+        if isinstance(value, list):
+            if len(value) == 0:
+                # assume default value again
+                return None
+
+            # choose first value
+            value = value[0]
+        return _convert_value(value)
+
+    return _convert
+
+
+@functools.lru_cache(maxsize=4096)
+def _fix_allowed_value(value: str, allowed_values: tuple[str, ...]) -> str:
+    """ Fix a single value to the best matching allowed value.
+    Cached, as the same wrong values (like cuisine names) come up often """
+    return process.extractOne(value, allowed_values)[0]
+
+
+def _process_choice(value) -> str:
+    """ Same processing as thefuzz.process.extractOne applies to its choices """
+    return full_process(value, force_ascii=True)
+
+
+@dataclass(frozen=True, slots=True)
+class _FieldPlan:
+    """ Precompiled instructions for loading a single field """
+    processed_name: str
+    convert: Callable[[Any], Any]
+    allowed_values: tuple[str, ...] | None
+    allowed_set: frozenset[str] | None
+
+    def fix_value(self, v):
+        """ Fix a single value v to one of the allowed values for this field """
+        if v is None:
+            return v
+
+        # v may already be allowed
+        if v in self.allowed_set:
+            return v
+        return _fix_allowed_value(v, self.allowed_values)
+
+
+@functools.cache
+def _compile_plan(cls) -> dict[str, _FieldPlan]:
+    """ Compile the plans for all fields of a Fixable class, once per class """
+    plan = {}
+    for field in dataclasses.fields(cls):
+        allowed_values = field.metadata.get("allowed_values")
+        plan[field.name] = _FieldPlan(
+            processed_name=_process_choice(field.name),
+            convert=_compile_converter(field.type),
+            allowed_values=tuple(allowed_values) if allowed_values is not None else None,
+            allowed_set=frozenset(allowed_values) if allowed_values is not None else None,
+        )
+    return plan
+
+
 class Fixable(abc.ABC):
     """
     Abstract (data)class that can be instantiated from a dictionary,
     loosely parsing the dictionary into its fields.
     """
 
-    @staticmethod
-    def _fix_field(field: dataclasses.Field, value: Any) -> Any:
-        if value is None:
-            # assume None means the default value
-            return None
-        elif isinstance(field.type, types.GenericAlias):
-            origin = typing.get_origin(field.type) or field.type
-            field_args = typing.get_args(field.type)
-
-            if origin is list:
-                # iterate through field values
-                subscript, = field_args
-
-                # the subscript may be subscripted itself
-                subscript = typing.get_origin(subscript) or subscript
-                if not isinstance(value, list):
-                    # make list of value
-                    value = [value]
-
-                # initialize elementwise
-                if issubclass(subscript, Fixable):
-                    assert all(isinstance(v, dict) for v in value)
-                    return [subscript.from_data(**v) for v in value]
-                elif dataclasses.is_dataclass(subscript):
-                    assert all(isinstance(v, dict) for v in value)
-                    return [subscript(**v) for v in value]
-                elif subscript is not dict and _is_list_of_single_keyed_dicts(value):
-                    # all single-keyed dicts with the same key, take the value
-                    # this fixes an issue where ChatGPT returns a list of
-                    # {'step': 'step text'} dicts for the recipe steps
-                    # instead of converting to subscript directly, we take the first
-                    # (and only) dict value
-                    return [subscript(next(iter(v.values()))) for v in value]
-                else:
-                    return list(subscript(v) for v in value)
-            else:
-                raise NotImplementedError(f"GenericAlias {field.type} loading")
-        else:
-            # value may be a list, like in a form submission
-            if isinstance(value, list):
-                if len(value) == 0:
-                    # assume default value again
-                    return None
-
-                # choose first value
-                value = value[0]
-
-            if issubclass(field.type, Fixable):
-                return field.type.from_data(**value)
-            elif dataclasses.is_dataclass(field.type):
-                return field.type(**value)
-            else:
-                return field.type(value)
-
     @classmethod
     def from_data(cls, **kwargs):
-        fields = {field.name: field for field in dataclasses.fields(cls)}
+        plan = _compile_plan(cls)
         fixed = {}
-        for key, field in fields.items():
+        choices = None
+        for key, field_plan in plan.items():
             value = kwargs.get(key)
 
             if value is None:
                 # did not find field, extract best match
-                value, score, key = process.extractOne(key, kwargs)
-
-                if score < 90:
+                # this is process.extractOne(key, kwargs), but only
+                # processes the choices once for all missing fields
+                if choices is None:
+                    choices = {k: _process_choice(v) for k, v in kwargs.items() if v is not None}
+
+                # a rounded score below 90 is no match
+                match = rprocess.extractOne(
+                    field_plan.processed_name, choices,
+                    scorer=rfuzz.WRatio,
+                    score_cutoff=89.5
+                )
+                if match is None:
                     # no match, use default value
                     continue
 
-            fixed[key] = Fixable._fix_field(field, value)
+                _, _, key = match
+                value = kwargs[key]
+
+            # None means the default value
+            fixed[key] = field_plan.convert(value) if value is not None else None
 
         # validate allowed values
         for key, value in fixed.items():
             if value is None:
                 continue
 
-            # get allowed values
-            field = fields[key]
-            allowed_values = field.metadata.get("allowed_values")
-            if allowed_values is None:
+            field_plan = plan[key]
+            if field_plan.allowed_values is None:
                 continue
 
-            def _fix_value(v):
-                """Fix a single value v to one of the allowed values for this field"""
-                if v is None:
-                    return v
-
-                # v may already be allowed
-                if v in allowed_values:
-                    return v
-                return process.extractOne(v, allowed_values)[0]
-
             if isinstance(value, list):
-                value = [_fix_value(v) for v in value]
+                value = [field_plan.fix_value(v) for v in value]
             else:
-                value = _fix_value(value)
+                value = field_plan.fix_value(value)
             fixed[key] = value
 
         return cls(**fixed)
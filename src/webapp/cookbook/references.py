@@ -1,11 +1,14 @@
-from thefuzz.fuzz import ratio
+from rapidfuzz.fuzz import ratio
+from rapidfuzz.process import extract_iter
 from typing import Iterable
-from functools import lru_cache
+from functools import lru_cache, partial
 import re
 from dataclasses import dataclass
 
 
 THRESHOLD = 80
+# ratios are rounded (half to even) before comparing them to THRESHOLD
+_SCORE_CUTOFF = THRESHOLD + 0.5
 
 
 @dataclass
@@ -35,47 +38,72 @@ def _process_string(s: str):
     return re.sub(" +", " ", re.sub(r"[^a-z ]+", " ", s.lower())).strip()
 
 
-def _partial_search(s1: str, s2: str) -> Iterable[_PartialMatch]:
+class _StepWords:
+    """ Processed words of a recipe step, with the
+    spans of words that ingredients are compared to """
+
+    def __init__(self, step: str):
+        self.words = _process_string(step).split(" ")
+        self._spans: dict[int, list[str]] = {}
+
+    def spans(self, size: int) -> list[str]:
+        """ Span of (at most) size words starting at every word """
+        if size not in self._spans:
+            self._spans[size] = _spans(self.words, size)
+        return self._spans[size]
+
+
+def _spans(words: list[str], size: int) -> list[str]:
+    return [" ".join(words[i:i + size]) for i in range(len(words))]
+
+
+def _partial_search(query: list[str], step: _StepWords) -> Iterable[_PartialMatch]:
     """ Reimplemented from
     https://github.com/seatgeek/fuzzywuzzy/blob/af443f918eebbccff840b86fa606ac150563f466/fuzzywuzzy/fuzz.py#L34
     Rewritten to return the best matched substring """
-    s1 = _process_string(s1).split(" ")
-    s2 = _process_string(s2).split(" ")
-
-    if len(s1) <= len(s2):
-        shorter = s1
-        longer = s2
+    if len(query) <= len(step.words):
+        shorter = query
+        longer = step.words
+        spans = step.spans
     else:
-        shorter = s2
-        longer = s1
+        shorter = step.words
+        longer = query
+        spans = partial(_spans, query)
 
     shorter_str = " ".join(shorter)
-    for i in range(len(longer)):
-        for j in range(len(shorter) - 1, len(shorter) + 2):
-            long_substr = " ".join(longer[i:i + j])
-            r = ratio(shorter_str, long_substr)
 
-            if r > THRESHOLD:
-                yield _PartialMatch(
-                    matched=tuple(longer[i:i + j]),
-                    target_words=len(shorter),
-                    score=int(round(100 * r))
-                )
+    # score all spans of each size in a single batch
+    matches = []
+    for k, j in enumerate(range(len(shorter) - 1, len(shorter) + 2)):
+        for _, r, i in extract_iter(shorter_str, spans(j), scorer=ratio, score_cutoff=_SCORE_CUTOFF):
+            if r > _SCORE_CUTOFF:
+                matches.append((i, k, j, r))
+
+    # yield the matches in the order they are found in
+    for i, _, j, r in sorted(matches):
+        yield _PartialMatch(
+            matched=tuple(longer[i:i + j]),
+            target_words=len(shorter),
+            score=100 * int(round(r))
+        )
 
 
-def _fuzzy_extract(query: str, text: str) -> Iterable[_PartialMatch]:
-    """  Fuzzy extract 'query' from 'text'
-    Yields all _PartialMatches """
-    query = _process_string(query)
-    words = query.split(" ")
+def _ingredient_queries(ingredient: str) -> list[list[str]]:
+    """ Spans of words of an ingredient to find in recipe steps, longest first """
+    words = _process_string(ingredient).split(" ")
 
+    queries = []
     for i in range((len(words) // 2) + 1):
         # find longest match first
         # match at least half the words
         for j in reversed(range(i + ((len(words) + 1) // 2), len(words) + 1)):
-            substr = " ".join(words[i:j])
-            for match in _partial_search(substr, text):
-                yield match
+            queries.append(_process_string(" ".join(words[i:j])).split(" "))
+    return queries
+
+
+@lru_cache(maxsize=4096)
+def _reference_regex(matched: tuple[str]) -> re.Pattern:
+    return re.compile(fr"(^|\W)({r'[^a-z]+'.join(matched)})(\W|$)", flags=re.IGNORECASE)
 
 
 def _replace_references(string: str, sorted_references: list[_PartialMatch]) -> str:
@@ -86,8 +114,7 @@ def _replace_references(string: str, sorted_references: list[_PartialMatch]) ->
     
     # replace current match
     ref = sorted_references[0]
-    regex = re.compile(fr"(^|\W)({r'[^a-z]+'.join(ref.matched)})(\W|$)", flags=re.IGNORECASE)
-    split = regex.split(string)
+    split = _reference_regex(ref.matched).split(string)
 
     # rebuild string with nested replacements
     new = ""
@@ -98,32 +125,51 @@ def _replace_references(string: str, sorted_references: list[_PartialMatch]) ->
     return new + _replace_references(split[0], sorted_references[1:])
 
 
+def _find_references(step: _StepWords, ingredients: list[tuple[int, list[list[str]]]]) -> list[_PartialMatch]:
+    """ Find the best reference for every matched part of a step,
+    sorted in the order they should be replaced """
+    ingredient_references = {}
+    for i, queries in ingredients:
+        for query in queries:
+            for match in _partial_search(query, step):
+                match.ingredient_idx = i
+                if match.matched not in ingredient_references:
+                    # new match
+                    ingredient_references[match.matched] = match
+                elif match.score > ingredient_references[match.matched].score:
+                    # better match
+                    ingredient_references[match.matched] = match
+
+    return sorted(
+        ingredient_references.values(),
+        key=lambda ref: ref.sort_val()
+    )
+
+
+def annotate_steps(recipe_steps: Iterable[str], ingredients: tuple[str]) -> list[str]:
+    """ Find ingredient references in all steps of a recipe,
+    given an (ordered!) list of ingredients """
+    queries = [
+        (i, _ingredient_queries(ingredient))
+        for i, ingredient in enumerate(ingredients)
+        # skip headers
+        if not ingredient.startswith("#")
+    ]
+
+    annotated = []
+    for recipe_step in recipe_steps:
+        sorted_references = _find_references(_StepWords(recipe_step), queries)
+
+        # no matches, no need to replace, just return the original string
+        if not sorted_references:
+            annotated.append(recipe_step)
+        else:
+            annotated.append(_replace_references(recipe_step, sorted_references))
+    return annotated
+
+
 @lru_cache(maxsize=1024)
 def replace_ingredient_references(recipe_step: str, ingredients: tuple[str]) -> str:
     """ Find ingredient references in a recipe step,
     given an (ordered!) list of ingredients """
-    ingredient_references = {}
-    for i, ingredient in enumerate(ingredients):
-        if ingredient.startswith("#"):
-            # skip headers
-            continue
-
-        for match in _fuzzy_extract(ingredient, recipe_step):
-            match.ingredient_idx = i
-            if match.matched not in ingredient_references:
-                # new match
-                ingredient_references[match.matched] = match
-            elif match.score > ingredient_references[match.matched].score:
-                # better match
-                ingredient_references[match.matched] = match
-
-    # no matches, no need to replace, just return the original string
-    if not ingredient_references:
-        return recipe_step
-    
-    # sort the references and replace them in order
-    sorted_references: list[_PartialMatch] = sorted(
-        ingredient_references.values(), 
-        key=lambda ref: ref.sort_val()
-    )
-    return _replace_references(recipe_step, sorted_references)
+    return annotate_steps((recipe_step,), ingredients)[0]
@@ -0,0 +1,172 @@
+""" Strict schema for recipes stored in the repository.
+
+Collections are written by us, so they can be decoded directly into typed
+structs, skipping the fuzzy repairs of Fixable.from_data. Those are only
+needed for LLM output and form input. Recipes that do not match the schema
+still fall back to Fixable.from_data. """
+
+import dataclasses
+import logging
+
+import msgspec
+
+from .meta import *
+from .recipe import Recipe, RecipeMeta, Ingredient, Nutrition
+
+logger = logging.getLogger(__name__)
+
+_LANGUAGES = frozenset(LANGUAGES)
+_MEAL_TYPES = frozenset(MEAL_TYPES)
+_MEAT_TYPES = frozenset(MEAT_TYPES)
+_CARB_TYPES = frozenset(CARB_TYPES)
+_CUISINE_TYPES = frozenset(CUISINE_TYPES)
+_TEMPERATURE_TYPES = frozenset(TEMPERATURE_TYPES)
+
+
+class RecipeMetaStruct(msgspec.Struct):
+    language: str | None = None
+    meal_type: str | None = None
+    meat_type: list[str] | None = None
+    carb_type: list[str] | None = None
+    cuisine: str | None = None
+    temperature: str | None = None
+
+
+class IngredientStruct(msgspec.Struct):
+    ingredient: str
+    amount: str | None = None
+
+
+class NutritionStruct(msgspec.Struct):
+    group: str
+    amount: str | None = None
+
+
+class RecipeStruct(msgspec.Struct):
+    name: str | None = None
+    meta: RecipeMetaStruct | None = None
+    time: int | None = None
+    people: int | None = None
+    url: str | None = None
+    ingredients: list[IngredientStruct] | None = None
+    preparation: list[str] | None = None
+    nutrition: list[NutritionStruct] | None = None
+    remarks: str | None = None
+    thumbnail: str | None = None
+    date_created: float | None = None
+    date_updated: float | None = None
+    igcode: str | None = None
+
+
+_decoder = msgspec.json.Decoder(dict[str, RecipeStruct], strict=False)
+_raw_decoder = msgspec.json.Decoder(dict[str, msgspec.Raw])
+_recipe_decoder = msgspec.json.Decoder(RecipeStruct, strict=False)
+
+
+def _without_none(**kwargs) -> dict:
+    """ None means the default value, like in Fixable.from_data """
+    return {key: value for key, value in kwargs.items() if value is not None}
+
+
+def _is_allowed(value, allowed: frozenset[str]) -> bool:
+    if value is None:
+        return True
+    if isinstance(value, list):
+        return all(v in allowed for v in value)
+    return value in allowed
+
+
+def _to_meta(meta: RecipeMetaStruct) -> RecipeMeta | None:
+    """ Convert meta, or return None if it has values that are not allowed """
+    if not (_is_allowed(meta.language, _LANGUAGES)
+            and _is_allowed(meta.meal_type, _MEAL_TYPES)
+            and _is_allowed(meta.meat_type, _MEAT_TYPES)
+            and _is_allowed(meta.carb_type, _CARB_TYPES)
+            and _is_allowed(meta.cuisine, _CUISINE_TYPES)
+            and _is_allowed(meta.temperature, _TEMPERATURE_TYPES)):
+        return None
+
+    return RecipeMeta(**_without_none(
+        language=meta.language,
+        meal_type=meta.meal_type,
+        meat_type=meta.meat_type,
+        carb_type=meta.carb_type,
+        cuisine=meta.cuisine,
+        temperature=meta.temperature,
+    ))
+
+
+def _to_recipe(recipe: RecipeStruct) -> Recipe:
+    """ Convert a decoded recipe, falling back to
+    Fixable.from_data for values that are not allowed """
+    meta = None
+    if recipe.meta is not None:
+        meta = _to_meta(recipe.meta)
+        if meta is None:
+            logger.debug(f"Recipe {recipe.name} has invalid metadata, fixing it")
+            return Recipe.from_data(**msgspec.to_builtins(recipe))
+
+    return Recipe(**_without_none(
+        name=recipe.name,
+        meta=meta,
+        time=recipe.time,
+        people=recipe.people,
+        url=recipe.url,
+        ingredients=[
+            Ingredient(ingredient=ingredient.ingredient, amount=ingredient.amount)
+            for ingredient in recipe.ingredients
+        ] if recipe.ingredients is not None else None,
+        preparation=recipe.preparation,
+        nutrition=[
+            Nutrition(group=nutrition.group, amount=nutrition.amount)
+            for nutrition in recipe.nutrition
+        ] if recipe.nutrition is not None else None,
+        remarks=recipe.remarks,
+        thumbnail=recipe.thumbnail,
+        date_created=recipe.date_created,
+        date_updated=recipe.date_updated,
+        igcode=recipe.igcode,
+    ))
+
+
+def decode_recipe(data: bytes) -> Recipe:
+    """ Decode a single recipe, falling back to Fixable.from_data
+    if it does not match the schema """
+    try:
+        return _to_recipe(_recipe_decoder.decode(data))
+    except msgspec.ValidationError as e:
+        logger.debug(f"Recipe does not match schema ({e}), fixing it")
+        return Recipe.from_data(**msgspec.json.decode(data))
+
+
+def decode_recipes(data: bytes) -> dict[str, Recipe]:
+    """ Decode an encoded collection file """
+    try:
+        recipes = _decoder.decode(data)
+    except msgspec.ValidationError:
+        # decode the recipes one by one, so only the
+        # invalid recipes need to be fixed
+        return {
+            recipe_id: decode_recipe(recipe)
+            for recipe_id, recipe in _raw_decoder.decode(data).items()
+        }
+
+    return {
+        recipe_id: _to_recipe(recipe)
+        for recipe_id, recipe in recipes.items()
+    }
+
+
+def encode_recipes(recipes: dict[str, Recipe]) -> bytes:
+    """ Encode a collection like it is stored in a single file """
+    data = msgspec.json.encode({
+        recipe_id: dataclasses.asdict(recipe)
+        for recipe_id, recipe in recipes.items()
+    }, order="sorted")
+    return msgspec.json.format(data, indent=2)
+
+
+def encode_recipe(recipe: Recipe) -> bytes:
+    """ Encode a recipe like it is stored in a recipe file """
+    data = msgspec.json.encode(dataclasses.asdict(recipe), order="sorted")
+    return msgspec.json.format(data, indent=2)
@@ -0,0 +1,244 @@
+""" Full-text search over the recipes of a collection.
+
+Recipes are tokenized into (lightly) stemmed Dutch and English terms,
+and kept in an inverted index that is updated per changed recipe.
+Results are ranked with BM25, where matches in the name and ingredients
+weigh more than matches in the preparation and remarks. The last term
+of a query can be a prefix, for searching while typing. """
+
+import bisect
+import functools
+import heapq
+import math
+import re
+import unicodedata
+from collections import defaultdict
+
+from .recipe import Recipe
+
+# BM25 parameters
+K1 = 1.2
+B = 0.75
+
+# weight of a term occurring in each part of a recipe
+FIELD_WEIGHTS = {
+    "name": 3.0,
+    "ingredients": 2.0,
+    "preparation": 1.0,
+    "remarks": 1.0,
+}
+
+# prefixes are only expanded from this length,
+# and to at most this many terms
+MIN_PREFIX_LENGTH = 2
+MAX_PREFIX_TERMS = 20
+
+_WORD_REGEX = re.compile(r"\w+")
+
+_STOPWORDS = frozenset({
+    # English
+    "a", "an", "and", "the", "of", "with", "in", "on", "to", "for", "or", "it", "is", "at", "into",
+    # Dutch
+    "de", "het", "een", "en", "van", "met", "op", "te", "voor", "of", "in", "is", "er", "aan", "tot",
+})
+
+
+def _normalize(text: str) -> str:
+    """ Lowercase text, and strip accents (crème -> creme) """
+    text = text.lower()
+    if text.isascii():
+        return text
+    text = unicodedata.normalize("NFKD", text)
+    return "".join(c for c in text if not unicodedata.combining(c))
+
+
+def _undouble(word: str) -> str:
+    if len(word) > 3 and word[-1] == word[-2] and word[-1] not in "aeiou":
+        return word[:-1]
+    return word
+
+
+def _stem_en(word: str) -> str:
+    """ Strip common English inflections """
+    if len(word) <= 3:
+        return word
+    if word.endswith("ies"):
+        return word[:-3] + "y"
+    if word.endswith(("sses", "shes", "ches", "xes", "zes", "oes")):
+        return word[:-2]
+    if word.endswith("s") and not word.endswith(("ss", "us", "is")):
+        return word[:-1]
+    if word.endswith("ing") and len(word) > 5:
+        return _undouble(word[:-3])
+    if word.endswith("ed") and len(word) > 4:
+        return _undouble(word[:-2])
+    return word
+
+
+def _stem_nl(word: str) -> str:
+    """ Strip common Dutch inflections and diminutives, and shorten long
+    vowels, so open and closed syllables match (tomaten, tomaat -> tomat) """
+    if len(word) <= 3:
+        return word
+    if word.endswith("heden"):
+        word = word[:-5] + "heid"
+    elif word.endswith(("tjes", "pjes")):
+        word = word[:-4]
+    elif word.endswith(("tje", "pje")):
+        word = word[:-3]
+    elif word.endswith(("jes", "ens")):
+        word = word[:-3]
+    elif word.endswith(("je", "en")):
+        word = _undouble(word[:-2])
+    elif word.endswith("s") and not word.endswith("ss") and len(word) > 4:
+        word = word[:-1]
+    elif word.endswith("e") and len(word) > 4:
+        word = _undouble(word[:-1])
+    return _shorten_vowels(word)
+
+
+def _shorten_vowels(word: str) -> str:
+    for vowel in "aeou":
+        word = word.replace(vowel * 2, vowel)
+    return word
+
+
+_STEMMERS = {
+    "en": _stem_en,
+    "nl": _stem_nl,
+}
+
+
+def _words(text: str) -> list[str]:
+    return [word for word in _WORD_REGEX.findall(_normalize(text)) if word not in _STOPWORDS]
+
+
+@functools.lru_cache(maxsize=65536)
+def _stems(word: str, language: str | None) -> frozenset[str]:
+    """ Terms for a word, for all languages if the language is not known """
+    if language in _STEMMERS:
+        return frozenset((_STEMMERS[language](word),))
+    return frozenset(stem(word) for stem in _STEMMERS.values())
+
+
+def _recipe_terms(recipe: Recipe) -> dict[str, float]:
+    """ Weighted term frequencies of a recipe """
+    fields = {
+        "name": [recipe.name],
+        "ingredients": [ingredient.ingredient for ingredient in recipe.ingredients],
+        "preparation": recipe.preparation,
+        "remarks": [recipe.remarks or ""],
+    }
+    terms = defaultdict(float)
+    for field, texts in fields.items():
+        weight = FIELD_WEIGHTS[field]
+        for text in texts:
+            for word in _words(text):
+                for term in _stems(word, recipe.meta.language):
+                    terms[term] += weight
+    return terms
+
+
+class SearchIndex:
+
+    """ Inverted index over the recipes of a collection """
+
+    def __init__(self):
+        self.recipes: dict[str, Recipe] = {}  # indexed recipes
+        self.postings: dict[str, dict[str, float]] = {}  # term -> recipe id -> frequency
+        self.terms: list[str] = []  # sorted, for prefix search
+        self.lengths: dict[str, float] = {}  # recipe id -> document length
+        self.total_length = 0.0
+
+        # terms per recipe, for removing it
+        self._recipe_terms: dict[str, dict[str, float]] = {}
+
+    def _remove(self, recipe_id: str):
+        del self.recipes[recipe_id]
+        for term in self._recipe_terms.pop(recipe_id):
+            postings = self.postings[term]
+            del postings[recipe_id]
+            if not postings:
+                del self.postings[term]
+                del self.terms[bisect.bisect_left(self.terms, term)]
+        self.total_length -= self.lengths.pop(recipe_id)
+
+    def _add(self, recipe_id: str, recipe: Recipe, sorted_terms: bool = True):
+        terms = _recipe_terms(recipe)
+        self.recipes[recipe_id] = recipe
+        self._recipe_terms[recipe_id] = terms
+        for term, frequency in terms.items():
+            if term not in self.postings:
+                self.postings[term] = {}
+                if sorted_terms:
+                    bisect.insort(self.terms, term)
+            self.postings[term][recipe_id] = frequency
+        self.lengths[recipe_id] = sum(terms.values())
+        self.total_length += self.lengths[recipe_id]
+
+    def sync(self, recipes: dict[str, Recipe]):
+        """ Update the index to a collection, only reindexing the recipes that changed """
+        for recipe_id in [recipe_id for recipe_id in self.recipes if recipe_id not in recipes]:
+            self._remove(recipe_id)
+
+        changed = [
+            (recipe_id, recipe) for recipe_id, recipe in recipes.items()
+            if self.recipes.get(recipe_id) is not recipe
+        ]
+        if len(changed) > len(self.terms):
+            # many new recipes (initial build), sort the terms once afterwards
+            for recipe_id, recipe in changed:
+                if recipe_id in self.recipes:
+                    self._remove(recipe_id)
+                self._add(recipe_id, recipe, sorted_terms=False)
+            self.terms = sorted(self.postings)
+            return
+
+        for recipe_id, recipe in changed:
+            if recipe_id in self.recipes:
+                self._remove(recipe_id)
+            self._add(recipe_id, recipe)
+
+    def _expand_prefix(self, prefix: str) -> list[str]:
+        if len(prefix) < MIN_PREFIX_LENGTH:
+            return []
+        start = bisect.bisect_left(self.terms, prefix)
+        end = bisect.bisect_left(self.terms, prefix + "\uffff", lo=start)
+        return self.terms[start:min(end, start + MAX_PREFIX_TERMS)]
+
+    def search(self, query: str, limit: int = 20, prefix: bool = False) -> list[tuple[str, float]]:
+        """ Get the best matching recipe ids, with their scores. If prefix
+        is set, the last word of the query may be incomplete. """
+        words = _WORD_REGEX.findall(_normalize(query))
+        if not words or not self.recipes:
+            return []
+
+        # candidate terms for every word of the query, an incomplete
+        # last word may be a stopword (to -> tomato)
+        alternatives = [_stems(word, None) for word in words[:-1] if word not in _STOPWORDS]
+        if prefix:
+            alternatives.append(
+                _stems(words[-1], None)
+                | set(self._expand_prefix(words[-1]))
+                | set(self._expand_prefix(_shorten_vowels(words[-1])))
+            )
+        elif words[-1] not in _STOPWORDS:
+            alternatives.append(_stems(words[-1], None))
+
+        count = len(self.recipes)
+        average_length = self.total_length / count
+        scores = defaultdict(float)
+        for terms in alternatives:
+            # a word matches a recipe with its best matching term
+            frequencies = {}
+            for term in terms:
+                for recipe_id, frequency in self.postings.get(term, {}).items():
+                    if frequency > frequencies.get(recipe_id, 0):
+                        frequencies[recipe_id] = frequency
+
+            idf = math.log(1 + (count - len(frequencies) + 0.5) / (len(frequencies) + 0.5))
+            for recipe_id, frequency in frequencies.items():
+                norm = K1 * (1 - B + B * self.lengths[recipe_id] / average_length)
+                scores[recipe_id] += idf * frequency * (K1 + 1) / (frequency + norm)
+
+        return heapq.nlargest(limit, scores.items(), key=lambda item: item[1])
@@ -0,0 +1,152 @@
+""" Second-level collection cache, shared between workers through Redis.
+
+Collections are stored by name and file sha, next to a pointer to
+the current sha. Workers publish an invalidation after pushing a collection,
+so other workers pick up the change immediately. """
+
+import asyncio
+import functools
+import logging
+import os
+from collections.abc import Awaitable, Callable
+
+import msgspec.json
+import redis.asyncio as redis
+
+logger = logging.getLogger(__name__)
+
+_REDIS_URL = os.getenv("REDIS_URL")
+ENABLED = _REDIS_URL is not None and bool(int(os.environ.get("RECIPE_SHARED_CACHE", "1")))
+
+PREFIX = "collection"
+INVALIDATE_CHANNEL = f"{PREFIX}:invalidate"
+
+# time a fetching worker may hold the lock for a collection
+LOCK_TIMEOUT_MS = 30000
+
+_redis = redis.from_url(_REDIS_URL) if ENABLED else None
+
+
+class CollectionPointer(msgspec.Struct):
+    sha: str
+    etag: str | None = None
+
+
+class Invalidation(msgspec.Struct):
+    collection: str
+    sha: str
+
+
+def _ignore_errors(default=None):
+    """ The shared cache is only an optimization, fall back
+    to the default value if Redis is unavailable """
+
+    def decorator(f):
+        @functools.wraps(f)
+        async def decorated_function(*args, **kwargs):
+            if not ENABLED:
+                return default
+            try:
+                return await f(*args, **kwargs)
+            except redis.RedisError as e:
+                logger.warning(f"Shared collection cache unavailable: {e}")
+                return default
+
+        return decorated_function
+
+    return decorator
+
+
+@_ignore_errors()
+async def get_pointer(collection: str) -> CollectionPointer | None:
+    """ Get the current sha (and ETag) for a collection """
+    value = await _redis.get(f"{PREFIX}:{collection}")
+    if value is None:
+        return None
+    return msgspec.json.decode(value, type=CollectionPointer)
+
+
+@_ignore_errors()
+async def get_collection(collection: str, sha: str) -> bytes | None:
+    """ Get encoded collection data by sha """
+    return await _redis.get(f"{PREFIX}:{collection}:{sha}")
+
+
+@_ignore_errors()
+async def put_collection(collection: str, sha: str, etag: str | None, data: bytes | None,
+                         ttl_ms: int, data_ttl_ms: int):
+    """ Store the encoded collection data, and point the collection to it.
+    If data is None, the existing data is kept alive instead. """
+    async with _redis.pipeline(transaction=True) as pipe:
+        if data is not None:
+            pipe.set(f"{PREFIX}:{collection}:{sha}", data, px=data_ttl_ms)
+        else:
+            pipe.pexpire(f"{PREFIX}:{collection}:{sha}", data_ttl_ms)
+        pipe.set(
+            f"{PREFIX}:{collection}",
+            msgspec.json.encode(CollectionPointer(sha=sha, etag=etag)),
+            px=ttl_ms
+        )
+        await pipe.execute()
+
+
+@_ignore_errors(default=True)
+async def acquire_fetch_lock(collection: str) -> bool:
+    """ Try to become the only worker fetching a collection.
+    Without the shared cache, every worker fetches on its own. """
+    return bool(await _redis.set(f"{PREFIX}:{collection}:lock", 1, nx=True, px=LOCK_TIMEOUT_MS))
+
+
+@_ignore_errors()
+async def release_fetch_lock(collection: str):
+    await _redis.delete(f"{PREFIX}:{collection}:lock")
+
+
+@_ignore_errors()
+async def publish_invalidation(collection: str, sha: str):
+    """ Notify all workers that a collection changed """
+    await _redis.publish(
+        INVALIDATE_CHANNEL,
+        msgspec.json.encode(Invalidation(collection=collection, sha=sha))
+    )
+
+
+async def listen_invalidations(callback: Callable[[str, str], Awaitable[None]]):
+    """ Call callback(collection, sha) for every published invalidation,
+    reconnecting if the connection to Redis is lost """
+    if not ENABLED:
+        return
+
+    while True:
+        try:
+            async with _redis.pubsub(ignore_subscribe_messages=True) as pubsub:
+                await pubsub.subscribe(INVALIDATE_CHANNEL)
+                async for message in pubsub.listen():
+                    try:
+                        invalidation = msgspec.json.decode(message["data"], type=Invalidation)
+                    except msgspec.DecodeError:
+                        logger.warning(f"Invalid collection invalidation: {message['data']}")
+                        continue
+                    await callback(invalidation.collection, invalidation.sha)
+        except redis.RedisError as e:
+            logger.warning(f"Lost collection invalidation channel: {e}")
+            await asyncio.sleep(5)
+
+
+@_ignore_errors(default={})
+async def get_steps(keys: list[str]) -> dict[str, list[str]]:
+    """ Get the annotated steps of recipes by key """
+    values = await _redis.mget([f"{PREFIX}:steps:{key}" for key in keys])
+    return {
+        key: msgspec.json.decode(value, type=list[str])
+        for key, value in zip(keys, values) if value is not None
+    }
+
+
+@_ignore_errors()
+async def put_steps(steps: dict[str, list[str]], ttl_ms: int):
+    """ Store the annotated steps of recipes by key """
+    async with _redis.pipeline(transaction=False) as pipe:
+        for key, value in steps.items():
+            pipe.set(f"{PREFIX}:steps:{key}", msgspec.json.encode(value), px=ttl_ms)
+        await pipe.execute()
@@ -0,0 +1,137 @@
+""" On-disk snapshots of the last retrieved collections, so a (re)started
+worker can serve them right away, and keep serving them if the recipe
+repository is unavailable. Changes that could not be pushed before a
+worker stopped are kept next to them, for the next worker to push. """
+
+import asyncio
+import logging
+import mmap
+import os
+import uuid
+from pathlib import Path
+
+import msgspec.msgpack
+
+logger = logging.getLogger(__name__)
+
+_PERSIST_DIR = os.getenv("PERSIST_DIR")
+ENABLED = _PERSIST_DIR is not None
+
+
+class Snapshot(msgspec.Struct):
+    sha: str
+    etag: str | None
+    data: bytes  # encoded collection file
+
+
+class PendingChanges(msgspec.Struct):
+    changes: dict[str, bytes | None]  # encoded recipes, None for deleted recipes
+    base: dict[str, bytes | None]  # the retrieved recipes the changes were made on
+    messages: list[str]
+
+
+_encoder = msgspec.msgpack.Encoder()
+_decoder = msgspec.msgpack.Decoder(Snapshot)
+_pending_decoder = msgspec.msgpack.Decoder(PendingChanges)
+
+# pending changes are written per worker, so stopping workers do not overwrite each other's
+_WORKER = uuid.uuid4().hex
+
+
+def _get_snapshot_file(collection: str) -> Path:
+    return Path(_PERSIST_DIR) / f"{collection}.snapshot"
+
+
+def _read_snapshot(collection: str) -> Snapshot | None:
+    path = _get_snapshot_file(collection)
+    try:
+        with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            return _decoder.decode(mm)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError, msgspec.DecodeError) as e:
+        logger.warning(f"Failed to read snapshot of collection {collection}: {e}")
+        return None
+
+
+def _write_file(path: Path, data: bytes):
+    path.parent.mkdir(parents=True, exist_ok=True)
+
+    # write to a temporary file first, so a crash never leaves a partial file
+    tmp = path.with_suffix(".tmp")
+    with open(tmp, "wb") as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+def _write_snapshot(collection: str, snapshot: Snapshot):
+    _write_file(_get_snapshot_file(collection), _encoder.encode(snapshot))
+
+
+def _modified(path: Path) -> float:
+    try:
+        return path.stat().st_mtime
+    except FileNotFoundError:
+        return 0
+
+
+def _take_pending(collection: str) -> list[PendingChanges]:
+    """ Read and remove the pending changes left by stopped workers """
+    pending = []
+    for path in sorted(Path(_PERSIST_DIR).glob(f"{collection}.*.pending"), key=_modified):
+        # claim the file, another starting worker may be reading it as well
+        claimed = path.with_name(f"{path.name}.{_WORKER}.claimed")
+        try:
+            os.replace(path, claimed)
+        except FileNotFoundError:
+            continue
+        try:
+            with open(claimed, "rb") as f:
+                pending.append(_pending_decoder.decode(f.read()))
+        except (OSError, msgspec.DecodeError) as e:
+            # keep the file, so the changes can be recovered by hand
+            logger.error(f"Failed to read pending changes of collection {collection} from {claimed}: {e}")
+            continue
+        os.remove(claimed)
+    return pending
+
+
+async def read_snapshot(collection: str) -> Snapshot | None:
+    """ Read the last snapshot of a collection """
+    if not ENABLED:
+        return None
+    return await asyncio.to_thread(_read_snapshot, collection)
+
+
+async def write_snapshot(collection: str, sha: str, etag: str | None, data: bytes):
+    """ Replace the snapshot of a collection """
+    if not ENABLED:
+        return
+    try:
+        await asyncio.to_thread(_write_snapshot, collection, Snapshot(sha=sha, etag=etag, data=data))
+    except OSError as e:
+        logger.warning(f"Failed to write snapshot of collection {collection}: {e}")
+
+
+async def write_pending(collection: str, pending: PendingChanges) -> bool:
+    """ Keep the pending changes of a collection for the next worker, return whether this succeeded """
+    if not ENABLED:
+        return False
+    path = Path(_PERSIST_DIR) / f"{collection}.{_WORKER}.pending"
+    try:
+        await asyncio.to_thread(_write_file, path, _encoder.encode(pending))
+    except OSError as e:
+        logger.error(f"Failed to write pending changes of collection {collection}: {e}")
+        return False
+    return True
+
+
+async def take_pending(collection: str) -> list[PendingChanges]:
+    """ Get the pending changes of a collection left by stopped workers, oldest first """
+    if not ENABLED:
+        return []
+    try:
+        return await asyncio.to_thread(_take_pending, collection)
+    except OSError as e:
+        logger.error(f"Failed to read pending changes of collection {collection}: {e}")
+        return []
@@ -0,0 +1,86 @@
+""" Recipe steps annotated with ingredient references, computed once per
+version (sha) of a recipe in the background, instead of while rendering it.
+Annotations are shared between workers through the shared cache. """
+
+import asyncio
+import datetime
+import logging
+
+from .recipe import Recipe
+from .references import annotate_steps
+from . import shared
+
+logger = logging.getLogger(__name__)
+
+# bump when the ingredient reference matching changes,
+# so annotations in the shared cache are recomputed
+STEPS_VERSION = 1
+
+STEPS_TTL = datetime.timedelta(days=7)
+
+
+def _annotate(recipe: Recipe) -> list[str]:
+    return annotate_steps(
+        recipe.preparation,
+        tuple(ingredient.ingredient for ingredient in recipe.ingredients)
+    )
+
+
+def _key(sha: str) -> str:
+    return f"{sha}:{STEPS_VERSION}"
+
+
+class RecipeSteps:
+
+    """ Annotated steps of the recipes of a collection """
+
+    def __init__(self):
+        self.steps: dict[str, list[str]] = {}  # recipe sha -> annotated steps
+
+        # sha per recipe id, only rehashed when the recipe changed
+        self._shas: dict[str, tuple[Recipe, str]] = {}
+
+    def _sha(self, recipe_id: str, recipe: Recipe) -> str:
+        known = self._shas.get(recipe_id)
+        if known is not None and known[0] is recipe:
+            return known[1]
+        return recipe.sha.hexdigest()
+
+    def get(self, recipe_id: str, recipe: Recipe) -> list[str]:
+        """ Get the annotated steps of a recipe, annotating
+        it right away if the background sync did not get to it yet """
+        sha = self._sha(recipe_id, recipe)
+        if sha not in self.steps:
+            logger.debug(f"Annotating recipe {recipe.name} on request")
+            self.steps[sha] = _annotate(recipe)
+        return self.steps[sha]
+
+    async def sync(self, recipes: dict[str, Recipe]):
+        """ Annotate the recipes that changed, taking the annotations
+        from the shared cache if another worker computed them already """
+        self._shas = {
+            recipe_id: (recipe, self._sha(recipe_id, recipe))
+            for recipe_id, recipe in recipes.items()
+        }
+        current = {sha: recipe for recipe, sha in self._shas.values()}
+        for sha in [sha for sha in self.steps if sha not in current]:
+            del self.steps[sha]
+
+        missing = [sha for sha in current if sha not in self.steps]
+        if not missing:
+            return
+
+        for key, steps in (await shared.get_steps([_key(sha) for sha in missing])).items():
+            self.steps[key.split(":")[0]] = steps
+
+        computed = {}
+        for sha in missing:
+            if sha in self.steps:
+                continue
+            self.steps[sha] = computed[_key(sha)] = _annotate(current[sha])
+            # do not block requests while annotating a whole collection
+            await asyncio.sleep(0)
+
+        logger.debug(f"Annotated {len(computed)} recipes, {len(missing) - len(computed)} from shared cache")
+        if computed:
+            await shared.put_steps(computed, int(STEPS_TTL.total_seconds() * 1000))
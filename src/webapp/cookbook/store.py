@@ -0,0 +1,65 @@
+""" Storage backends for recipe collections.
+
+A backend retrieves and stores whole collections, selected with RECIPE_STORE:
+- file: GitHub repository, a single {collection}.json file per collection
+- tree: GitHub repository, a file per recipe
+- local: SQLite database with a row per recipe, see local.py
+"""
+
+import abc
+import dataclasses
+
+from .recipe import Recipe
+
+from typing import TYPE_CHECKING
+if TYPE_CHECKING:
+    from .cookbook import CollectionCache
+
+
+@dataclasses.dataclass(slots=True)
+class FetchResult:
+    sha: str
+    etag: str | None
+    # None if the collection did not change
+    recipes: dict[str, Recipe] | None = None
+    # encoded collection, if available without re-encoding
+    data: bytes | None = None
+    # blob sha per recipe file, None for a single file collection
+    blobs: dict[str, str] | None = None
+
+
+@dataclasses.dataclass(slots=True)
+class PushResult:
+    sha: str
+    # encoded collection, if available without re-encoding
+    data: bytes | None = None
+    # blob sha per recipe file, None for a single file collection
+    blobs: dict[str, str] | None = None
+
+
+class RecipeStore(abc.ABC):
+    """ Storage backend for recipe collections """
+
+    @abc.abstractmethod
+    async def fetch(self, collection: str, col: 'CollectionCache') -> FetchResult:
+        """ Retrieve a collection. The cached collection is passed so unchanged
+        collections (or recipes) do not need to be retrieved again. """
+
+    @abc.abstractmethod
+    async def push(self, collection: str, col: 'CollectionCache', changes: dict[str, Recipe | None],
+                   message: str) -> PushResult:
+        """ Store a collection. The changed recipes (None for deleted recipes)
+        are already applied to the cached collection. """
+
+
+def get_store(name: str) -> RecipeStore:
+    """ Create the storage backend with the given name. Backends are imported
+    on demand, so only the configuration of the selected backend is needed. """
+    if name == "local":
+        from .local import LocalStore
+        return LocalStore()
+
+    from .github import LAYOUTS
+    if name not in LAYOUTS:
+        raise ValueError(f"Unknown recipe store: {name}")
+    return LAYOUTS[name]()
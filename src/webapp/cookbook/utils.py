@@ -10,6 +10,11 @@ class InstagramError(CookbookError):
     pass
 
 
+class RecipeConflictError(CookbookError):
+    """ The collection changed in the repository since it was retrieved """
+    pass
+
+
 _NO_USER_AGENT = {
     "cdninstagram",
     "ig",
@@ -1,3 +1,4 @@
 from .models import Views
 from .init import init_db
-from .base import Session, Base
+from .views import init_views, close_views
+from .base import Session, Base, init_sessions
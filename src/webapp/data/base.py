@@ -1,9 +1,102 @@
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.ext.declarative import declarative_base
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+import asyncio
 import os
 
+from .metrics import InstrumentedPool, instrument
+
+from typing import TYPE_CHECKING
+if TYPE_CHECKING:
+    from sanic import Sanic, Request, HTTPResponse
+
+# connections per worker, DB_POOL_SIZE + DB_MAX_OVERFLOW times the number
+# of workers should stay below the max_connections of the database
+DB_POOL_SIZE = int(os.environ.get("DB_POOL_SIZE", 5))
+DB_MAX_OVERFLOW = int(os.environ.get("DB_MAX_OVERFLOW", 5))
+
+# seconds to wait for a connection when all are checked out
+DB_POOL_TIMEOUT = float(os.environ.get("DB_POOL_TIMEOUT", 30))
+
+# test connections before using them, to survive database restarts
+DB_POOL_PRE_PING = bool(int(os.environ.get("DB_POOL_PRE_PING", "1")))
+
+# prepared statements cached per connection by asyncpg,
+# should be 0 behind a pooler in transaction mode (pgbouncer)
+DB_STATEMENT_CACHE_SIZE = os.getenv("DB_STATEMENT_CACHE_SIZE")
+
+_DATABASE_URL = os.environ["DATABASE_URL"]
+
+_connect_args = {}
+if DB_STATEMENT_CACHE_SIZE is not None and "+asyncpg" in _DATABASE_URL:
+    _connect_args["statement_cache_size"] = int(DB_STATEMENT_CACHE_SIZE)
 
 Base = declarative_base()
-engine = create_async_engine(os.environ["DATABASE_URL"])
-Session = sessionmaker(bind=engine, class_=AsyncSession)
+engine = create_async_engine(
+    _DATABASE_URL,
+    poolclass=InstrumentedPool,
+    pool_size=DB_POOL_SIZE,
+    max_overflow=DB_MAX_OVERFLOW,
+    pool_timeout=DB_POOL_TIMEOUT,
+    pool_pre_ping=DB_POOL_PRE_PING,
+    connect_args=_connect_args
+)
+instrument(engine)
+
+# objects stay usable after a later commit in the same request
+_Session = sessionmaker(bind=engine, class_=AsyncSession, expire_on_commit=False)
+
+
+class _RequestScope:
+
+    """ The session shared by the handler of a request """
+
+    def __init__(self):
+        self.task = asyncio.current_task()
+        self.session: AsyncSession | None = None
+        self.closed = False
+
+
+_scope: ContextVar[_RequestScope | None] = ContextVar("session_scope", default=None)
+
+
+@asynccontextmanager
+async def Session():
+    """ Get the session of the current request, opened on first use and
+    closed after the response. Outside a request, and in tasks started
+    by it (such as asyncio.gather), every call opens a new session. """
+    scope = _scope.get()
+    if scope is None or scope.closed or scope.task is not asyncio.current_task():
+        async with _Session() as session:
+            yield session
+        return
+
+    if scope.session is None:
+        scope.session = _Session()
+    try:
+        yield scope.session
+    except BaseException:
+        # the next use in this request starts a new transaction
+        await scope.session.rollback()
+        raise
+
+
+def init_sessions(app: 'Sanic'):
+    """ Share a session between the database calls in a request handler """
+
+    @app.on_request(priority=100)
+    async def open_session_scope(request: 'Request'):
+        request.ctx.session_scope = _RequestScope()
+        _scope.set(request.ctx.session_scope)
+
+    @app.on_response(priority=-100)
+    async def close_session_scope(request: 'Request', response: 'HTTPResponse'):
+        scope = getattr(request.ctx, "session_scope", None)
+        if scope is None:
+            return
+        scope.closed = True
+        if scope.session is not None:
+            # rolls back whatever the handler did not commit
+            await scope.session.close()
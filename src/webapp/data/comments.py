@@ -1,48 +1,48 @@
 from .models import Comment, User
 from .base import Session
-from sqlalchemy import select, and_, func
+from .stats import lock_stats, update_comment_stats
+from .users import UnknownUserException
+from sqlalchemy import select, and_, func, delete, literal
+from sqlalchemy.dialects.postgresql import insert
 import datetime
 
 
-async def get_comments(collection, recipe_id):
+async def add_comment(collection, recipe_id, user_id, text, rating):
+    now = datetime.datetime.now()
     async with Session() as session:
+        await lock_stats(session, collection, recipe_id)
+        # only insert the comment if the user (still) exists
         result = await session.execute(
-            select(Comment, User) \
-                .where(and_(
-                    Comment.recipe_collection == collection,
-                    Comment.recipe_id == recipe_id
-                )).filter(
-                    Comment.user_id == User.id
-                )
+            insert(Comment).from_select(
+                ["recipe_collection", "recipe_id", "user_id", "rating", "text", "date_posted"],
+                select(
+                    literal(collection), literal(recipe_id), User.id,
+                    literal(rating), literal(text), literal(now)
+                ).where(User.id == user_id)
+            ).on_conflict_do_update(
+                index_elements=[Comment.recipe_collection, Comment.recipe_id, Comment.user_id],
+                set_={"text": text, "rating": rating, "date_edited": now}
+            ).returning(Comment.id)
         )
-        return result.all()
+        comment_id = result.scalar()
+        if comment_id is None:
+            raise UnknownUserException(user_id)
+        await update_comment_stats(session, collection, recipe_id)
+        await session.commit()
+    return comment_id
 
 
-async def add_comment(collection, recipe_id, user_id, text, rating):
+async def delete_comment(collection, recipe_id, user_id):
     async with Session() as session:
-        result = await session.execute(
-            select(Comment).where(and_(
+        await lock_stats(session, collection, recipe_id)
+        await session.execute(
+            delete(Comment).where(and_(
                 Comment.recipe_collection == collection,
                 Comment.recipe_id == recipe_id,
                 Comment.user_id == user_id
             ))
         )
-        comment = result.scalar()
-        if comment is None:
-            session.add(
-                Comment(
-                    recipe_collection=collection,
-                    recipe_id=recipe_id,
-                    user_id=user_id,
-                    rating=rating,
-                    text=text,
-                    date_posted=datetime.datetime.now()
-                )
-            )
-        else:
-            comment.text = text
-            comment.rating = rating
-            comment.date_edited = datetime.datetime.now()
+        await update_comment_stats(session, collection, recipe_id)
         await session.commit()
 
 
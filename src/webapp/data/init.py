@@ -1,4 +1,5 @@
-from .base import Base, engine
+from .base import engine
+from .migrations import migrate
 from .users import register_user, UserExistsException
 import os
 import logging
@@ -13,7 +14,7 @@ logger = logging.getLogger(__name__)
 async def init_db(app: 'Sanic', loop):
     logger.info("Initializing DB")
     async with engine.begin() as conn:
-        await conn.run_sync(Base.metadata.create_all)
+        await conn.run_sync(migrate)
 
     try:
         await register_user(os.environ.get("ADMIN_USER", "admin"), os.environ["PASSWORD"], force_verified=True)
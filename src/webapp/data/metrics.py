@@ -0,0 +1,92 @@
+""" Connection pool and query metrics of the database engine, per worker """
+
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+from sqlalchemy import event, exc
+import bisect
+import time
+import os
+
+from typing import TYPE_CHECKING
+if TYPE_CHECKING:
+    from sqlalchemy.ext.asyncio import AsyncEngine
+
+# upper bounds of the histogram buckets, in milliseconds
+BUCKETS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500)
+
+
+class Histogram:
+
+    """ Counts of observed durations per bucket, the last bucket is unbounded """
+
+    def __init__(self, buckets: tuple[float, ...] = BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, ms: float):
+        self.counts[bisect.bisect_left(self.buckets, ms)] += 1
+        self.count += 1
+        self.sum += ms
+
+    def to_dict(self) -> dict:
+        return {
+            "buckets": {
+                **{f"le_{bound}": count for bound, count in zip(self.buckets, self.counts)},
+                "inf": self.counts[-1]
+            },
+            "count": self.count,
+            "sum_ms": round(self.sum, 3)
+        }
+
+
+checkout_wait = Histogram()
+query_latency = Histogram()
+timeouts = 0
+
+
+class InstrumentedPool(AsyncAdaptedQueuePool):
+
+    """ Pool recording the time spent waiting for a connection, including
+    opening a new connection if the pool has room for it, and the pre-ping """
+
+    def connect(self):
+        global timeouts
+        start = time.perf_counter()
+        try:
+            return super().connect()
+        except exc.TimeoutError:
+            timeouts += 1
+            raise
+        finally:
+            checkout_wait.observe((time.perf_counter() - start) * 1000)
+
+
+def _before_execute(conn, cursor, statement, parameters, context, executemany):
+    context._query_start = time.perf_counter()
+
+
+def _after_execute(conn, cursor, statement, parameters, context, executemany):
+    query_latency.observe((time.perf_counter() - context._query_start) * 1000)
+
+
+def instrument(engine: 'AsyncEngine'):
+    """ Record the latency of all queries on the engine """
+    event.listen(engine.sync_engine, "before_cursor_execute", _before_execute)
+    event.listen(engine.sync_engine, "after_cursor_execute", _after_execute)
+
+
+def get_metrics(engine: 'AsyncEngine') -> dict:
+    pool = engine.pool
+    return {
+        "pid": os.getpid(),
+        "pool": {
+            "size": pool.size(),
+            "checked_out": pool.checkedout(),
+            "checked_in": pool.checkedin(),
+            "overflow": pool.overflow(),
+            "timeouts": timeouts,
+        },
+        "checkout_wait": checkout_wait.to_dict(),
+        "query_latency": query_latency.to_dict(),
+    }
@@ -0,0 +1,31 @@
+""" A single comment and save per user per recipe, and the recipe_stats
+table (created from the models) filled from the existing rows """
+
+from sqlalchemy import text
+
+_UNIQUE_INDEXES = {
+    "comments": ("comments_user_recipe", ("recipe_collection", "recipe_id", "user_id")),
+    "saves": ("saves_user_recipe", ("user_id", "recipe_collection", "recipe_id")),
+}
+
+
+def upgrade(conn):
+    for table, (index, columns) in _UNIQUE_INDEXES.items():
+        # remove the duplicates the index does not allow, keeping the latest
+        duplicate = " AND ".join(f"a.{column} = b.{column}" for column in columns)
+        conn.execute(text(f"DELETE FROM {table} a USING {table} b WHERE a.id < b.id AND {duplicate}"))
+        conn.execute(text(f"CREATE UNIQUE INDEX IF NOT EXISTS {index} ON {table} ({', '.join(columns)})"))
+
+    conn.execute(text("DELETE FROM recipe_stats"))
+    conn.execute(text("""
+        INSERT INTO recipe_stats (recipe_collection, recipe_id, viewcount, comment_count, rating_sum, save_count)
+        SELECT recipe_collection, recipe_id, SUM(viewcount), SUM(comment_count), SUM(rating_sum), SUM(save_count)
+        FROM (
+            SELECT recipe_collection, recipe_id, viewcount, 0 AS comment_count, 0 AS rating_sum, 0 AS save_count FROM views
+            UNION ALL
+            SELECT recipe_collection, recipe_id, 0, 1, rating, 0 FROM comments
+            UNION ALL
+            SELECT recipe_collection, recipe_id, 0, 0, 0, 1 FROM saves
+        ) AS stats
+        GROUP BY recipe_collection, recipe_id
+    """))
@@ -0,0 +1,16 @@
+""" Key comments and saves by their id alone, include the rating in the
+comments index so ratings are read from the index, and index saves by recipe """
+
+from sqlalchemy import text
+
+
+def upgrade(conn):
+    for table in ("comments", "saves"):
+        conn.execute(text(f"ALTER TABLE {table} DROP CONSTRAINT {table}_pkey, ADD PRIMARY KEY (id)"))
+
+    conn.execute(text("DROP INDEX IF EXISTS comments_user_recipe"))
+    conn.execute(text(
+        "CREATE UNIQUE INDEX comments_user_recipe "
+        "ON comments (recipe_collection, recipe_id, user_id) INCLUDE (rating)"
+    ))
+    conn.execute(text("CREATE INDEX IF NOT EXISTS saves_recipe ON saves (recipe_collection, recipe_id)"))
@@ -0,0 +1,58 @@
+""" Schema migrations, applied in order at startup.
+
+A migration is a module NNNN_description.py in this package, with an
+upgrade(conn) function that is run on a synchronous connection, in the
+same transaction as recording it in the schema_migrations table.
+Migrations should not use the models, as those describe the latest schema.
+A new database is created from the models directly, with all migrations
+recorded as applied. """
+
+from sqlalchemy import inspect, text
+import importlib
+import pkgutil
+import logging
+
+from ..models import Base
+
+logger = logging.getLogger(__name__)
+
+MIGRATIONS_TABLE = "schema_migrations"
+
+# arbitrary key of the advisory lock that lets one worker at a time migrate
+_LOCK_KEY = 0x6d6967
+
+
+def _get_migrations() -> list[tuple[int, str]]:
+    migrations = []
+    for module in pkgutil.iter_modules(__path__):
+        version, _, _ = module.name.partition("_")
+        if version.isdigit():
+            migrations.append((int(version), module.name))
+    return sorted(migrations)
+
+
+def migrate(conn):
+    """ Bring the schema up to date, from a synchronous connection in a transaction """
+    conn.execute(text("SELECT pg_advisory_xact_lock(:key)"), {"key": _LOCK_KEY})
+
+    inspector = inspect(conn)
+    new_database = not inspector.has_table(MIGRATIONS_TABLE) and not inspector.get_table_names()
+    conn.execute(text(
+        f"CREATE TABLE IF NOT EXISTS {MIGRATIONS_TABLE} ("
+        "version INTEGER PRIMARY KEY, name VARCHAR NOT NULL, applied_at TIMESTAMP NOT NULL DEFAULT now())"
+    ))
+
+    # tables that were added to the models are created right away
+    Base.metadata.create_all(conn)
+
+    applied = set(conn.execute(text(f"SELECT version FROM {MIGRATIONS_TABLE}")).scalars())
+    for version, name in _get_migrations():
+        if version in applied:
+            continue
+        if not new_database:
+            logger.info(f"Applying migration {name}")
+            importlib.import_module(f"{__name__}.{name}").upgrade(conn)
+        conn.execute(
+            text(f"INSERT INTO {MIGRATIONS_TABLE} (version, name) VALUES (:version, :name)"),
+            {"version": version, "name": name}
+        )
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, DateTime, Boolean
+from sqlalchemy import Column, Integer, String, DateTime, Boolean, Index
 from sqlalchemy import select, update, and_, delete
 
 from .base import Base, Session
@@ -35,34 +35,37 @@ class RecipeBoundMixin:
             await session.commit()
 
 
-class UserRecipeBoundMixin:
-
-    """ Mixin for handling operations on user/recipe bound CRUD
-    operations """
+class Views(Base, RecipeBoundMixin):
+    __tablename__ = 'views'
 
-    @classmethod
-    async def delete_for_user(cls, user_id: str, collection: str, recipe_id: str):
-        async with Session() as session:
-            await session.execute(
-                delete(cls).where(and_(
-                    cls.recipe_collection == collection,
-                    cls.recipe_id == recipe_id,
-                    cls.user_id == user_id
-                ))
-            )
-            await session.commit()
+    recipe_collection = Column(String, primary_key=True)
+    recipe_id = Column(String, primary_key=True)
+    viewcount = Column(Integer, nullable=False, default=0)
 
+    def __repr__(self):
+        return f"<ViewCount({self.recipe_collection}/{self.recipe_id}: {self.viewcount})>"
 
 
-class Views(Base, RecipeBoundMixin):
-    __tablename__ = 'views'
+class RecipeStats(Base, RecipeBoundMixin):
+    """ Aggregates of the views, comments and saves of a recipe,
+    updated on every write, so they can be retrieved in one query """
+    __tablename__ = 'recipe_stats'
 
     recipe_collection = Column(String, primary_key=True)
     recipe_id = Column(String, primary_key=True)
     viewcount = Column(Integer, nullable=False, default=0)
+    comment_count = Column(Integer, nullable=False, default=0)
+    rating_sum = Column(Integer, nullable=False, default=0)
+    save_count = Column(Integer, nullable=False, default=0)
+
+    @property
+    def rating(self) -> float | None:
+        if not self.comment_count:
+            return None
+        return self.rating_sum / self.comment_count
 
     def __repr__(self):
-        return f"<ViewCount({self.recipe_collection}/{self.recipe_id}: {self.viewcount})>"
+        return f"<RecipeStats({self.recipe_collection}/{self.recipe_id}: {self.viewcount} views, {self.comment_count} comments, {self.save_count} saves)>"
 
 
 class User(Base):
@@ -78,13 +81,21 @@ class User(Base):
         return f"<User({self.username}" + (" [V]>" if self.verified else ")>")
 
 
-class Comment(Base, RecipeBoundMixin, UserRecipeBoundMixin):
+class Comment(Base, RecipeBoundMixin):
     __tablename__ = 'comments'
+    # a single comment per user per recipe, comments and ratings of a
+    # recipe or collection are read from this index alone
+    __table_args__ = (
+        Index(
+            "comments_user_recipe", "recipe_collection", "recipe_id", "user_id",
+            unique=True, postgresql_include=["rating"]
+        ),
+    )
 
     id = Column(Integer, primary_key=True, autoincrement=True)
-    recipe_collection = Column(String, primary_key=True)
-    recipe_id = Column(String, primary_key=True)
-    user_id = Column(Integer, primary_key=True)
+    recipe_collection = Column(String, nullable=False)
+    recipe_id = Column(String, nullable=False)
+    user_id = Column(Integer, nullable=False)
     rating = Column(Integer, nullable=False)
     text = Column(String, nullable=True)
     date_posted = Column(DateTime)
@@ -94,10 +105,15 @@ class Comment(Base, RecipeBoundMixin, UserRecipeBoundMixin):
         return f"<Comment({self.recipe_collection}/{self.recipe_id} {self.text} [{self.user_id}])>"
 
 
-class Save(Base, RecipeBoundMixin, UserRecipeBoundMixin):
+class Save(Base, RecipeBoundMixin):
     __tablename__ = 'saves'
+    # saves of a user, and saves of a recipe
+    __table_args__ = (
+        Index("saves_user_recipe", "user_id", "recipe_collection", "recipe_id", unique=True),
+        Index("saves_recipe", "recipe_collection", "recipe_id"),
+    )
 
     id = Column(Integer, primary_key=True, autoincrement=True)
-    user_id = Column(Integer, primary_key=True)
-    recipe_collection = Column(String, primary_key=True)
-    recipe_id = Column(String, primary_key=True)
\ No newline at end of file
+    user_id = Column(Integer, nullable=False)
+    recipe_collection = Column(String, nullable=False)
+    recipe_id = Column(String, nullable=False)
\ No newline at end of file
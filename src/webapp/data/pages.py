@@ -0,0 +1,75 @@
+""" Data of the recipe page reviews, loaded with a single statement:
+the comments with their users and the stored viewcount, while the
+counted views are retrieved from Redis at the same time. """
+
+from .models import Comment, User, Views
+from .base import Session
+from .views import get_buffered_single, register_view
+from sqlalchemy import select, and_, func, literal
+import dataclasses
+import asyncio
+import os
+
+
+@dataclasses.dataclass
+class RecipeReviews:
+    user_comment: Comment | None
+    comments_users: list[tuple[Comment, User]]  # the admin comment first
+    found_admin_comment: bool
+    viewcount: int
+
+
+async def _get_comments_viewcount(collection, recipe_id) -> tuple[list[tuple[Comment, User]], int]:
+    stored_viewcount = select(func.coalesce(func.max(Views.viewcount), 0)) \
+        .where(and_(Views.recipe_collection == collection, Views.recipe_id == recipe_id)) \
+        .scalar_subquery()
+
+    # a single row with the viewcount, joined with the comments if there are any
+    anchor = select(literal(1).label("anchor")).subquery()
+    async with Session() as session:
+        result = await session.execute(
+            select(stored_viewcount, Comment, User) \
+                .select_from(anchor) \
+                .outerjoin(
+                    Comment,
+                    and_(Comment.recipe_collection == collection, Comment.recipe_id == recipe_id)
+                ) \
+                .outerjoin(User, Comment.user_id == User.id) \
+                .order_by(Comment.id)
+        )
+        rows = result.all()
+
+    comments_users = [(comment, user) for _, comment, user in rows if comment is not None and user is not None]
+    return comments_users, rows[0][0]
+
+
+async def get_recipe_reviews(collection, recipe_id, username: str | None, new_view: bool) -> RecipeReviews:
+    """ Get the comments and viewcount of a recipe, after counting a view if new_view is set """
+    (comments_users, stored_viewcount), buffered = await asyncio.gather(
+        _get_comments_viewcount(collection, recipe_id),
+        get_buffered_single(collection, recipe_id, register=new_view)
+    )
+    if buffered is None:
+        buffered = 0
+        if new_view:
+            # counted again, or added to the views table directly
+            await register_view(collection, recipe_id)
+            buffered = 1
+
+    admin_user = os.environ.get("ADMIN_USER", "admin")
+    reviews = RecipeReviews(
+        user_comment=None,
+        comments_users=[],
+        found_admin_comment=False,
+        viewcount=stored_viewcount + buffered
+    )
+    for comment, user in comments_users:
+        if username is not None and user.username == username:
+            reviews.user_comment = comment
+        elif user.username == admin_user:
+            # place admin comment at the top
+            reviews.comments_users.insert(0, (comment, user))
+            reviews.found_admin_comment = True
+        else:
+            reviews.comments_users.append((comment, user))
+    return reviews
@@ -1,6 +1,9 @@
 from .models import Save, User
 from .base import Session
-from sqlalchemy import select, and_
+from .stats import lock_stats, update_save_stats
+from .users import UnknownUserException
+from sqlalchemy import select, and_, delete, literal
+from sqlalchemy.dialects.postgresql import insert
 
 
 async def get_saved(user_id, collection):
@@ -16,20 +19,34 @@ async def get_saved(user_id, collection):
 
 async def add_save(user_id, collection, recipe_id):
     async with Session() as session:
+        await lock_stats(session, collection, recipe_id)
+        # only insert the save if the user (still) exists, an existing
+        # save is updated without changes so it is returned as well
+        stmt = insert(Save).from_select(
+            ["user_id", "recipe_collection", "recipe_id"],
+            select(User.id, literal(collection), literal(recipe_id)).where(User.id == user_id)
+        )
         result = await session.execute(
-            select(Save).where(and_(
+            stmt.on_conflict_do_update(
+                index_elements=[Save.user_id, Save.recipe_collection, Save.recipe_id],
+                set_={"recipe_id": stmt.excluded.recipe_id}
+            ).returning(Save.id)
+        )
+        if result.scalar() is None:
+            raise UnknownUserException(user_id)
+        await update_save_stats(session, collection, recipe_id)
+        await session.commit()
+
+
+async def delete_save(user_id, collection, recipe_id):
+    async with Session() as session:
+        await lock_stats(session, collection, recipe_id)
+        await session.execute(
+            delete(Save).where(and_(
                 Save.user_id == user_id,
                 Save.recipe_collection == collection,
                 Save.recipe_id == recipe_id,
             ))
         )
-        comment = result.scalar()
-        if comment is None:
-            session.add(
-                Save(
-                    user_id=user_id,
-                    recipe_collection=collection,
-                    recipe_id=recipe_id,
-                )
-            )
-            await session.commit()
+        await update_save_stats(session, collection, recipe_id)
+        await session.commit()
@@ -0,0 +1,93 @@
+""" Per recipe aggregates of views, comments and saves (the recipe_stats table).
+The comment and save aggregates of a recipe are recomputed in the same
+transaction as every write to its comments or saves, views are added
+when they are flushed to the views table. """
+
+from .models import RecipeStats, Comment, Save
+from .base import Session
+from sqlalchemy import select, and_, func
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+
+async def lock_stats(session: AsyncSession, collection: str, recipe_id: str):
+    """ Lock the aggregates of a recipe until the end of the transaction, so
+    concurrent writes to its comments or saves are aggregated one after the other """
+    stmt = insert(RecipeStats).values(recipe_collection=collection, recipe_id=recipe_id)
+    await session.execute(stmt.on_conflict_do_update(
+        index_elements=[RecipeStats.recipe_collection, RecipeStats.recipe_id],
+        set_={"recipe_id": stmt.excluded.recipe_id}
+    ))
+
+
+def _upsert(collection: str, recipe_id: str, **values):
+    stmt = insert(RecipeStats).values(recipe_collection=collection, recipe_id=recipe_id, **values)
+    return stmt.on_conflict_do_update(
+        index_elements=[RecipeStats.recipe_collection, RecipeStats.recipe_id],
+        set_={name: getattr(stmt.excluded, name) for name in values}
+    )
+
+
+async def update_comment_stats(session: AsyncSession, collection: str, recipe_id: str):
+    """ Recompute the comment aggregates of a recipe """
+    of_recipe = and_(Comment.recipe_collection == collection, Comment.recipe_id == recipe_id)
+    await session.execute(_upsert(
+        collection, recipe_id,
+        comment_count=select(func.count()).where(of_recipe).scalar_subquery(),
+        rating_sum=select(func.coalesce(func.sum(Comment.rating), 0)).where(of_recipe).scalar_subquery()
+    ))
+
+
+async def update_save_stats(session: AsyncSession, collection: str, recipe_id: str):
+    """ Recompute the save count of a recipe """
+    of_recipe = and_(Save.recipe_collection == collection, Save.recipe_id == recipe_id)
+    await session.execute(_upsert(
+        collection, recipe_id,
+        save_count=select(func.count()).where(of_recipe).scalar_subquery()
+    ))
+
+
+# aggregates to recompute after writing to a table
+_STATS_UPDATES = {
+    Comment: update_comment_stats,
+    Save: update_save_stats,
+}
+
+
+def has_stats(table_class) -> bool:
+    """ Check if writes to a table should update the aggregates """
+    return table_class in _STATS_UPDATES
+
+
+async def lock_recipes_stats(session: AsyncSession, recipes: set[tuple[str, str]]):
+    """ Lock the aggregates of several recipes, as (collection, recipe_id),
+    in a fixed order so concurrent writes do not deadlock """
+    for collection, recipe_id in sorted(recipes):
+        await lock_stats(session, collection, recipe_id)
+
+
+async def update_recipes_stats(session: AsyncSession, table_class, recipes: set[tuple[str, str]]):
+    """ Recompute the aggregates of several recipes after writing to a table directly """
+    for collection, recipe_id in sorted(recipes):
+        await _STATS_UPDATES[table_class](session, collection, recipe_id)
+
+
+async def add_view_stats(session: AsyncSession, rows: list[dict]):
+    """ Add views, as rows of the views table """
+    stmt = insert(RecipeStats).values(rows)
+    await session.execute(stmt.on_conflict_do_update(
+        index_elements=[RecipeStats.recipe_collection, RecipeStats.recipe_id],
+        set_={"viewcount": RecipeStats.viewcount + stmt.excluded.viewcount}
+    ))
+
+
+async def get_stats(collection: str) -> dict[str, RecipeStats]:
+    """ Get the aggregates of all recipes in a collection """
+    async with Session() as session:
+        result = await session.execute(
+            select(RecipeStats) \
+                .where(RecipeStats.recipe_collection == collection)
+        )
+        return {
+            stats.recipe_id: stats for stats in result.scalars().all()
+        }
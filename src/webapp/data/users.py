@@ -4,7 +4,14 @@ from .models import User
 from .base import Session
 from hashlib import sha256
 from sqlalchemy import select, func
+from collections import OrderedDict
 import datetime
+import time
+
+# user ids for tokens without one, by username
+USER_ID_TTL = 5 * 60
+USER_ID_CACHE_SIZE = 1024
+_user_ids: OrderedDict[str, tuple[int, float]] = OrderedDict()
 
 
 class UserExistsException(Exception):
@@ -19,6 +26,10 @@ class RegistrationError(Exception):
     pass
 
 
+class UnknownUserException(Exception):
+    pass
+
+
 async def _get_user(session, username) -> User:
     username = username.strip()
     result = await session.execute(
@@ -43,28 +54,49 @@ async def get_user(username) -> User | None:
         return await _get_user(session, username.strip())
 
 
+async def get_user_id(username) -> int | None:
+    """ Get the id of a user, cached for USER_ID_TTL seconds """
+    username = username.strip()
+    cached = _user_ids.get(username)
+    if cached is not None and cached[1] > time.monotonic():
+        _user_ids.move_to_end(username)
+        return cached[0]
+
+    user = await get_user(username)
+    if user is None:
+        _user_ids.pop(username, None)
+        return None
+    _user_ids[username] = (user.id, time.monotonic() + USER_ID_TTL)
+    _user_ids.move_to_end(username)
+    while len(_user_ids) > USER_ID_CACHE_SIZE:
+        _user_ids.popitem(last=False)
+    return user.id
+
+
 async def login_user(username, password) -> User | None:
     username = username.strip()
     async with Session() as session:
-        return (await _login_user(session, username, password)) is not None
+        return await _login_user(session, username, password)
 
 
-async def register_user(username, password, force_verified=False):
+async def register_user(username, password, force_verified=False) -> int:
     username = username.strip()
     async with Session() as session:
         user = await _get_user(session, username)
         if user is not None:
             raise UserExistsException(username)
 
-        session.add(
-            User(
-                username=username,
-                password=sha256(password.encode()).hexdigest(),
-                date_registered=datetime.datetime.now(),
-                verified=force_verified
-            )
+        user = User(
+            username=username,
+            password=sha256(password.encode()).hexdigest(),
+            date_registered=datetime.datetime.now(),
+            verified=force_verified
         )
+        session.add(user)
+        await session.flush()
+        user_id = user.id
         await session.commit()
+    return user_id
 
 
 async def update_user_password(username, newpassword):
@@ -1,47 +1,153 @@
+""" Recipe viewcounts. Views are counted in Redis, and added to the
+views table periodically in a single statement, so registering a view
+does not wait for (or contend on) a database write. Viewcounts include
+the views that were not added to the table yet. """
+
 from .models import Views
 from .base import Session
-from sqlalchemy import select, and_
+from .stats import add_view_stats
+from sqlalchemy.dialects.postgresql import insert
+import redis.asyncio as redis
+import asyncio
+import logging
+import os
 
+from typing import TYPE_CHECKING
+if TYPE_CHECKING:
+    from sanic import Sanic
 
-async def get_viewcount(collection):
-    async with Session() as session:
-        result = await session.execute(
-            select(Views) \
-                .where(Views.recipe_collection == collection)
-        )
-        views = result.scalars().all()
+logger = logging.getLogger(__name__)
+
+# interval between adding the counted views to the table, in seconds
+VIEWS_FLUSH_INTERVAL = float(os.environ.get("VIEWS_FLUSH_INTERVAL", 10))
+
+# rows per insert statement, postgres allows at most 32767 parameters
+_FLUSH_BATCH_SIZE = 5000
+
+PREFIX = "views:counted"
 
-    return {
-        view.recipe_id: view.viewcount for view in views
-    }
+_redis = redis.from_url(os.environ["REDIS_URL"], decode_responses=True)
 
 
-async def _get_viewcount(session, collection, recipe_id):
-    result = await session.execute(
-        select(Views) \
-            .where(and_(Views.recipe_collection == collection, Views.recipe_id == recipe_id))
-    )
-    return result.scalar()
+def _buffer_key(collection: str) -> str:
+    return f"{PREFIX}:{collection}"
 
 
-async def get_viewcount_single(collection, recipe_id):
+async def get_buffered(collection: str) -> dict[str, int]:
+    try:
+        counts = await _redis.hgetall(_buffer_key(collection))
+    except redis.RedisError as e:
+        logger.warning(f"Counted views unavailable: {e}")
+        return {}
+    return {recipe_id: int(count) for recipe_id, count in counts.items()}
+
+
+async def _add_views(counts: dict[tuple[str, str], int]):
+    """ Add views to the views table, as {(collection, recipe_id): views} """
+    # rows are locked in a fixed order, so concurrent flushes do not deadlock
+    rows = [
+        {"recipe_collection": collection, "recipe_id": recipe_id, "viewcount": counts[collection, recipe_id]}
+        for collection, recipe_id in sorted(counts)
+    ]
+    batches = [rows[i:i + _FLUSH_BATCH_SIZE] for i in range(0, len(rows), _FLUSH_BATCH_SIZE)]
     async with Session() as session:
-        views = await _get_viewcount(session, collection, recipe_id)
-        if views is None:
-            return 0
-        return views.viewcount
+        for batch in batches:
+            stmt = insert(Views).values(batch)
+            await session.execute(stmt.on_conflict_do_update(
+                index_elements=[Views.recipe_collection, Views.recipe_id],
+                set_={"viewcount": Views.viewcount + stmt.excluded.viewcount}
+            ))
+        # after all views, so the order does not depend on the batches
+        for batch in batches:
+            await add_view_stats(session, batch)
+        await session.commit()
 
 
-async def incr_viewcount(collection, recipe_id):
+async def get_buffered_single(collection, recipe_id, register: bool = False) -> int | None:
+    """ Get the counted views of a recipe that are not stored yet, after counting
+    a view if register is set, or None if they are unavailable """
+    try:
+        if register:
+            return await _redis.hincrby(_buffer_key(collection), recipe_id, 1)
+        return int(await _redis.hget(_buffer_key(collection), recipe_id) or 0)
+    except redis.RedisError as e:
+        logger.warning(f"Counted views unavailable: {e}")
+        return None
+
+
+async def _incr_stored_viewcount(collection, recipe_id) -> int:
+    """ Add a view to the views table, and get the stored viewcount """
+    stmt = insert(Views).values(recipe_collection=collection, recipe_id=recipe_id, viewcount=1)
     async with Session() as session:
-        views = await _get_viewcount(session, collection, recipe_id)
-
-        if views is not None:
-            views.viewcount += 1
-        else:
-            views = Views(recipe_collection=collection, recipe_id=recipe_id, viewcount=1)
-            session.add(views)
-        viewcount = views.viewcount
+        result = await session.execute(
+            stmt.on_conflict_do_update(
+                index_elements=[Views.recipe_collection, Views.recipe_id],
+                set_={"viewcount": Views.viewcount + 1}
+            ).returning(Views.viewcount)
+        )
+        viewcount = result.scalar()
+        await add_view_stats(session, [{"recipe_collection": collection, "recipe_id": recipe_id, "viewcount": 1}])
         await session.commit()
     return viewcount
 
+
+async def register_view(collection, recipe_id):
+    """ Count a view, without waiting for the database """
+    try:
+        await _redis.hincrby(_buffer_key(collection), recipe_id, 1)
+    except redis.RedisError as e:
+        logger.warning(f"Failed to count view, adding it directly: {e}")
+        await _incr_stored_viewcount(collection, recipe_id)
+
+
+async def flush_views():
+    """ Add the counted views of all collections to the views table """
+    counts = {}
+    try:
+        async for key in _redis.scan_iter(match=f"{PREFIX}:*"):
+            collection = key[len(PREFIX) + 1:]
+
+            # take the counted views, new views are counted from zero again
+            async with _redis.pipeline(transaction=True) as pipe:
+                pipe.hgetall(key)
+                pipe.delete(key)
+                buffered, _ = await pipe.execute()
+            for recipe_id, count in buffered.items():
+                counts[(collection, recipe_id)] = int(count)
+    except redis.RedisError as e:
+        logger.warning(f"Counted views unavailable: {e}")
+
+    if not counts:
+        return
+    try:
+        await _add_views(counts)
+    except Exception:
+        # put the views back, to be added on the next flush
+        async with _redis.pipeline(transaction=False) as pipe:
+            for (collection, recipe_id), count in counts.items():
+                pipe.hincrby(_buffer_key(collection), recipe_id, count)
+            await pipe.execute()
+        raise
+    logger.debug(f"Added views of {len(counts)} recipes")
+
+
+async def _flush_views_periodically():
+    while True:
+        await asyncio.sleep(VIEWS_FLUSH_INTERVAL)
+        try:
+            await flush_views()
+        except Exception as e:
+            logger.warning(f"Failed to add counted views: {e}")
+
+
+async def init_views(app: 'Sanic', loop):
+    """ Start adding counted views to the views table """
+    app.add_task(_flush_views_periodically(), name="flush_views")
+
+
+async def close_views(app: 'Sanic', loop):
+    """ Add the remaining counted views """
+    try:
+        await flush_views()
+    except Exception as e:
+        logger.warning(f"Failed to add counted views: {e}")
@@ -5,22 +5,28 @@ import auth
 import data.users as users
 import data.comments as comments
 import data.saves as saves
-from data.models import Comment, Save
 from limiter import RateLimiter
 
 
+async def _get_user_id(request: Request) -> int | None:
+    """ Get the id of the active user, from its token if it has one """
+    user_id = auth.get_user_id(request)
+    if user_id is None:
+        user_id = await users.get_user_id(auth.get_username(request))
+    return user_id
+
+
 def add_data_routes(app: Sanic):
     @app.get("/saved/<collection>")
     @auth.protected("user")
     async def get_saved(request: Request, collection):
         """ Get saved recipes in collection for active user """
-        username = auth.get_username(request)
-        user = await users.get_user(username)
-        if user is None:
+        user_id = await _get_user_id(request)
+        if user_id is None:
             return sanic.json({"error": "Unknown user"}, 400)
 
         return sanic.json({
-            "saves": await saves.get_saved(user.id, collection)
+            "saves": await saves.get_saved(user_id, collection)
         })
 
 
@@ -28,11 +34,13 @@ def add_data_routes(app: Sanic):
     @auth.protected("user")
     async def post_save(request: Request, collection, id):
         """ Save the recipe for the active user """
-        username = auth.get_username(request)
-        user = await users.get_user(username)
-        if user is None:
+        user_id = await _get_user_id(request)
+        if user_id is None:
+            return sanic.json({"error": "Unknown user"}, 400)
+        try:
+            await saves.add_save(user_id, collection, id)
+        except users.UnknownUserException:
             return sanic.json({"error": "Unknown user"}, 400)
-        await saves.add_save(user.id, collection, id)
         return sanic.empty()
 
 
@@ -40,12 +48,11 @@ def add_data_routes(app: Sanic):
     @auth.protected("user")
     async def delete_save(request: Request, collection, id):
         """ Unsave the recipe for the active user """
-        username = auth.get_username(request)
-        user = await users.get_user(username)
-        if user is None:
+        user_id = await _get_user_id(request)
+        if user_id is None:
             return sanic.json({"error": "Unknown user"}, 400)
         
-        await Save.delete_for_user(user.id, collection, id)
+        await saves.delete_save(user_id, collection, id)
         return sanic.empty()
 
 
@@ -53,9 +60,8 @@ def add_data_routes(app: Sanic):
     @auth.protected("user")
     async def post_comment(request: Request, collection, id):
         """ Post a comment on the recipe for the active user """
-        username = auth.get_username(request)
-        user = await users.get_user(username)
-        if user is None:
+        user_id = await _get_user_id(request)
+        if user_id is None:
             return sanic.json({"error": "Unknown user"}, 400)
         text = re.sub(r"\s+", " ", request.json.get("text").strip())
         if len(text) > 500:
@@ -64,7 +70,10 @@ def add_data_routes(app: Sanic):
         if rating is None or not (1 <= rating <= 5):
             return sanic.json({"error": "Rating should be between 1 and 5"}, 400)
 
-        await comments.add_comment(collection, id, user.id, text, rating)
+        try:
+            await comments.add_comment(collection, id, user_id, text, rating)
+        except users.UnknownUserException:
+            return sanic.json({"error": "Unknown user"}, 400)
         return sanic.empty()
 
 
@@ -72,10 +81,9 @@ def add_data_routes(app: Sanic):
     @auth.protected("user")
     async def delete_comment(request: Request, collection, id):
         """ Delete a comment on the recipe for the active user """
-        username = auth.get_username(request)
-        user = await users.get_user(username)
-        if user is None:
+        user_id = await _get_user_id(request)
+        if user_id is None:
             return sanic.json({"error": "Unknown user"}, 400)
 
-        await Comment.delete_for_user(user.id, collection, id)
+        await comments.delete_comment(collection, id, user_id)
         return sanic.empty()
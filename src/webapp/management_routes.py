@@ -4,6 +4,9 @@ import datetime
 import auth
 from data.models import *
 import data
+import data.stats as stats
+from data.base import engine
+from data.metrics import get_metrics
 from sqlalchemy import select
 
 
@@ -48,6 +51,13 @@ def col_type(col):
     return "string"
 
 
+def _recipes(table_class, *values: dict) -> set[tuple[str, str]]:
+    """ Recipes of the given rows, whose aggregates change when writing the rows """
+    if not stats.has_stats(table_class):
+        return set()
+    return {(value["recipe_collection"], value["recipe_id"]) for value in values}
+
+
 def add_management_routes(app: Sanic):
     """ Add data-management routes """
 
@@ -65,6 +75,12 @@ def add_management_routes(app: Sanic):
             "table_name": table_name
         }
 
+    @app.get("/manage/metrics/db")
+    @auth.protected("admin")
+    async def db_metrics(request):
+        """ Connection pool and query metrics of the worker handling the request """
+        return sanic.json(get_metrics(engine))
+
 
     @app.get("/api/<table_name>")
     @auth.protected("admin")
@@ -107,9 +123,13 @@ def add_management_routes(app: Sanic):
                         obj_data[col] = datetime.datetime.utcfromtimestamp(val / 1000)
             
             # create instance
+            recipes = _recipes(table_class, obj_data)
+            await stats.lock_recipes_stats(session, recipes)
             obj = table_class(**obj_data)
             session.add(obj)
+            await session.flush()
             res_data = to_dict(obj)
+            await stats.update_recipes_stats(session, table_class, recipes)
             await session.commit()
             return sanic.json({"data": res_data})
 
@@ -125,14 +145,24 @@ def add_management_routes(app: Sanic):
 
             if obj:
                 # convert datetime columns
+                values = {}
                 for key, value in request.json.items():
                     if isinstance(table_class.__table__.columns[key].type, (DateTime,)):
                         if isinstance(value, (int, float)):
                             value = datetime.datetime.utcfromtimestamp(value / 1000)
-                    
-                    # update object
+                    values[key] = value
+
+                # the row may move to another recipe
+                old = to_dict(obj)
+                recipes = _recipes(table_class, old, {**old, **values})
+                await stats.lock_recipes_stats(session, recipes)
+
+                # update object
+                for key, value in values.items():
                     setattr(obj, key, value)
+                await session.flush()
                 res_data = to_dict(obj)
+                await stats.update_recipes_stats(session, table_class, recipes)
                 await session.commit()
                 return sanic.json({"data": res_data})
             else:
@@ -148,7 +178,11 @@ def add_management_routes(app: Sanic):
             result = await session.execute(select(table_class).where(table_class.id == id))
             obj = result.scalar()
             if obj:
+                recipes = _recipes(table_class, to_dict(obj))
+                await stats.lock_recipes_stats(session, recipes)
                 await session.delete(obj)
+                await session.flush()
+                await stats.update_recipes_stats(session, table_class, recipes)
                 await session.commit()
                 return sanic.json({"message": "Deleted successfully"})
             else:
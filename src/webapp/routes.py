@@ -1,7 +1,7 @@
-from collections import OrderedDict
 import sanic
 import asyncio
-import os
+import bisect
+import dataclasses
 import hashlib
 from sanic import Request
 from sanic_ext import render
@@ -12,7 +12,10 @@ import cookbook
 import cookbook.instagram
 import data.views as views
 import data.users as users
-import data.comments as comments
+import data.pages as pages
+import data.stats as stats
+import utils.pagecache as pagecache
+import utils.edgecache as edgecache
 
 from dotenv import load_dotenv
 
@@ -63,33 +66,39 @@ async def collection(request: Request, collection: str = cookbook.DEFAULT_COLLEC
     username = auth.get_username(request)
 
     # check caching with collection SHA
+    collection_etag = await cookbook.get_collection_etag(collection)
     etag = _update_etag_reqinfo(
         hashlib.sha256(
-            (await cookbook.get_collection_etag(collection)).encode("ascii"),
+            collection_etag.encode("ascii"),
             usedforsecurity=False
         ),
         is_admin, is_user, username
     )
+    public = edgecache.is_public(request)
+    surrogate_keys = edgecache.collection_keys(collection, collection_etag)
 
     if not app.debug:
         if_match = request.headers.get("If-None-Match")
         if if_match is not None and if_match == etag:
             # use cached response
-            return sanic.empty(
+            response = sanic.empty(
                 headers={"ETag": etag},
                 status=304
             )
+            if public:
+                edgecache.make_public(request, response, surrogate_keys)
+            return response
 
-    recipes = await cookbook.get_recipes(collection)
+    # the page for admins shows the number of unverified users, do not cache it
+    cache_key = f"collection/{collection}"
+    use_cache = not app.debug and not is_admin
+    if use_cache and (cached := await pagecache.get_page(request, cache_key, etag)) is not None:
+        if public:
+            edgecache.make_public(request, cached, surrogate_keys)
+        return cached
 
-    # sort recipes by date_updated (default ordering)
-    ordered = OrderedDict(
-        sorted(
-            recipes.items(),
-            key=lambda x: x[1].date_updated,
-            reverse=True
-        )
-    )
+    # recipes ordered by date_updated (default ordering)
+    index = await cookbook.get_collection_index(collection)
 
     # user-specific rendering
     if username is not None:
@@ -102,7 +111,7 @@ async def collection(request: Request, collection: str = cookbook.DEFAULT_COLLEC
     else:
         unverified_users = None
 
-    return await render(
+    response = await render(
         "cookbook.html",
         headers={
             "ETag": etag
@@ -110,22 +119,204 @@ async def collection(request: Request, collection: str = cookbook.DEFAULT_COLLEC
         context={
             "collection": collection,
             "collections": cookbook.COLLECTIONS,
-            "recipes": ordered,
+            "recipes": index.ordered,
             "is_admin": is_admin,
             "is_user": is_user,
             "username": username,
-            "latest": max(recipes, key=lambda recipe_id: recipes[recipe_id].date_created, default=None),
+            "latest": index.latest,
             "unverified_users": unverified_users,
             "title": title,
         }
     )
+    if use_cache:
+        await pagecache.cache_page(request, cache_key, etag, response)
+    if public:
+        edgecache.make_public(request, response, surrogate_keys)
+    return response
+
+
+# sort keys for the collection API, the recipe stats
+# are not cached, and are sorted on request
+COLLECTION_SORT_KEYS = {"updated", "created", "views", "rating", "comments", "saves"}
+COLLECTION_PAGE_SIZE = 20
+COLLECTION_MAX_PAGE_SIZE = 100
+
+
+def _recipe_summary(recipe_id: str, recipe: cookbook.Recipe) -> dict:
+    """ Recipe info shown in a collection """
+    return {
+        "id": recipe_id,
+        "name": recipe.name,
+        "thumbnail": recipe.thumbnail,
+        "meta": dataclasses.asdict(recipe.meta),
+        "time": recipe.time,
+        "people": recipe.people,
+        "date_created": recipe.date_created,
+        "date_updated": recipe.date_updated,
+    }
+
+
+@app.get("/api/collection/<collection:str>")
+async def collection_api(request: Request, collection: str):
+    """ Get a page of a recipe collection, filtered on tags. The cursor is
+    the sort value, date_updated and id of the last recipe of the previous
+    page, and the next page starts at the first recipe after it, so pages
+    do not shift when the stats or the recipes change in between. With
+    format=html, the recipes are rendered like in the collection page. """
+    if collection not in cookbook.COLLECTIONS:
+        raise NotFound("No such collection exists on this website")
+
+    sort = request.args.get("sort", "updated")
+    if sort not in COLLECTION_SORT_KEYS:
+        return sanic.json({"error": f"Invalid sort key {sort}"}, 400)
+    try:
+        limit = max(1, min(int(request.args.get("limit", COLLECTION_PAGE_SIZE)), COLLECTION_MAX_PAGE_SIZE))
+    except ValueError:
+        return sanic.json({"error": "Invalid limit"}, 400)
+
+    index = await cookbook.get_collection_index(collection)
+    if sort in {"updated", "created"}:
+        sort_value = lambda recipe_id: getattr(index.ordered[recipe_id], f"date_{sort}")
+    else:
+        recipe_stats = await _get_recipe_stats(collection)
+        sort_value = lambda recipe_id: recipe_stats.get(recipe_id, {}).get(sort) or 0
+
+    def sort_key(recipe_id: str) -> tuple:
+        return sort_value(recipe_id), index.ordered[recipe_id].date_updated, recipe_id
+
+    if sort in {"updated", "created"}:
+        # sorted on the same key by the index
+        ordering = index.ordering(sort)
+    else:
+        # most recently updated first for equal stats
+        ordering = sorted(index.by_updated, key=sort_key, reverse=True)
+
+    start = 0
+    cursor = request.args.get("cursor")
+    if cursor:
+        try:
+            value, updated, recipe_id = cursor.split(":", 2)
+            after = (float(value), float(updated), recipe_id)
+        except ValueError:
+            return sanic.json({"error": "Invalid cursor"}, 400)
+        # the cursor recipe may have moved or been deleted since
+        start = bisect.bisect_left(ordering, True, key=lambda recipe_id: sort_key(recipe_id) < after)
+
+    # matching recipes in order, with one extra to see if there is a next page
+    matches = index.filtered({
+        field: request.args.getlist(field)
+        for field in cookbook.TAG_FIELDS
+        if field in request.args
+    })
+    page = []
+    for i in range(start, len(ordering)):
+        if matches is None or ordering[i] in matches:
+            page.append(ordering[i])
+            if len(page) > limit:
+                break
+
+    next_cursor = ":".join(map(str, sort_key(page[limit - 1]))) if len(page) > limit else None
+    page = page[:limit]
+
+    if request.args.get("format") == "html":
+        return await render(
+            "recipe_items.html",
+            headers={"X-Next-Cursor": next_cursor} if next_cursor is not None else None,
+            context={
+                "collection": collection,
+                "recipes": {recipe_id: index.ordered[recipe_id] for recipe_id in page},
+                "offset": start,
+                "is_admin": auth.is_admin(request),
+                "is_user": auth.is_user(request),
+            }
+        )
+
+    return sanic.json({
+        "recipes": [_recipe_summary(recipe_id, index.ordered[recipe_id]) for recipe_id in page],
+        "next": next_cursor,
+        "total": len(matches) if matches is not None else len(index),
+    })
+
+
+@app.get("/search")
+async def search(request: Request):
+    """ Search a recipe collection, with prefix=1 the last
+    word of the query may be incomplete (search while typing) """
+    collection = request.args.get("collection", cookbook.DEFAULT_COLLECTION)
+    if collection not in cookbook.COLLECTIONS:
+        raise NotFound("No such collection exists on this website")
+    try:
+        limit = max(1, min(int(request.args.get("limit", COLLECTION_PAGE_SIZE)), COLLECTION_MAX_PAGE_SIZE))
+    except ValueError:
+        return sanic.json({"error": "Invalid limit"}, 400)
+
+    results = await cookbook.search_recipes(
+        collection,
+        request.args.get("q", ""),
+        limit=limit,
+        prefix=request.args.get("prefix") == "1"
+    )
+    recipes = await cookbook.get_recipes(collection)
+    return sanic.json({
+        "recipes": [
+            {**_recipe_summary(recipe_id, recipes[recipe_id]), "score": score}
+            for recipe_id, score in results
+        ]
+    })
 
 
-@app.get("/views/<collection:str>")
-async def collection_views(request: Request, collection: str = cookbook.DEFAULT_COLLECTION):
-    """ Get viewcount for recipe collection """
+@app.get("/ingredients")
+async def ingredients(request: Request):
+    """ Find the recipes that can be made with the given ingredients (i=...),
+    in a single collection, or in all collections """
+    collections = request.args.getlist("collection") or sorted(cookbook.COLLECTIONS)
+    if any(collection not in cookbook.COLLECTIONS for collection in collections):
+        raise NotFound("No such collection exists on this website")
+    try:
+        limit = max(1, min(int(request.args.get("limit", COLLECTION_PAGE_SIZE)), COLLECTION_MAX_PAGE_SIZE))
+    except ValueError:
+        return sanic.json({"error": "Invalid limit"}, 400)
+
+    given = request.args.getlist("i")
+    results = []
+    for collection in collections:
+        recipes = await cookbook.get_recipes(collection)
+        for recipe_id, coverage, covered in await cookbook.match_ingredients(collection, given, limit=limit):
+            results.append({
+                **_recipe_summary(recipe_id, recipes[recipe_id]),
+                "collection": collection,
+                "coverage": coverage,
+                "covered": covered,
+            })
+
+    results.sort(key=lambda result: (result["coverage"], result["covered"]), reverse=True)
+    return sanic.json({"recipes": results[:limit]})
+
+
+async def _get_recipe_stats(collection: str) -> dict[str, dict]:
+    """ Get the views, average rating, comment count and save count
+    of all recipes in a collection, including the views that are not stored yet """
+    recipe_stats = {
+        recipe_id: {
+            "views": row.viewcount,
+            "rating": row.rating,
+            "comments": row.comment_count,
+            "saves": row.save_count,
+        }
+        for recipe_id, row in (await stats.get_stats(collection)).items()
+    }
+    for recipe_id, count in (await views.get_buffered(collection)).items():
+        if recipe_id not in recipe_stats:
+            recipe_stats[recipe_id] = {"views": 0, "rating": None, "comments": 0, "saves": 0}
+        recipe_stats[recipe_id]["views"] += count
+    return recipe_stats
+
+
+@app.get("/stats/<collection:str>")
+async def collection_stats(request: Request, collection: str = cookbook.DEFAULT_COLLECTION):
+    """ Get the stats of all recipes in a collection """
     return sanic.json(
-        await views.get_viewcount(collection)
+        await _get_recipe_stats(collection)
     )
 
 
@@ -136,28 +327,21 @@ async def about(request: Request):
     return {}
 
 
-async def _get_or_increment_recipe_views(request: Request, collection: str, id: str):
-    """ Get recipe viewcount, possibly incremented after request """
+def _is_new_recipe_view(request: Request, collection: str, id: str) -> bool:
+    """ Check if a recipe was not viewed in the session yet, and mark it as viewed """
     # only register a single recipe view per session
     session = request.ctx.session
     if "views" not in session:
         session["views"] = {}
     session_views = session["views"]
 
-    viewcount = None
     if collection in session_views:
         if id in session_views[collection]:
-            viewcount = await views.get_viewcount_single(collection, id)
-        else:
-            session_views[collection].append(id)
+            return False
+        session_views[collection].append(id)
     else:
         session_views[collection] = [id]
-
-    # increment views if recipe was not viewed in session
-    if viewcount is None:
-        viewcount = await views.incr_viewcount(collection, id)
-
-    return viewcount
+    return True
 
 
 @app.get("/recipe/<collection:str>/<id>")
@@ -174,54 +358,47 @@ async def recipe(request: Request, collection: str, id: str):
 
     # update recipe sha with user info
     recipe = recipes[id]
+    recipe_sha = recipe.sha
     etag = _update_etag_reqinfo(
-        recipe.sha,
+        recipe_sha.copy(),
         is_admin, is_user, username
     )
+    public = edgecache.is_public(request)
+    surrogate_keys = edgecache.recipe_keys(collection, id, recipe_sha.hexdigest())
     if not app.debug:
         if_match = request.headers.get("If-None-Match")
         if if_match is not None and if_match == etag:
             # use cached response
-            return sanic.empty(
+            response = sanic.empty(
                 headers={"ETag": etag},
                 status=304
             )
+            if public:
+                edgecache.make_public(request, response, surrogate_keys)
+            return response
+
+    # the view is registered when comments.js retrieves the reviews, so the
+    # page only depends on the recipe and the user, and can be served by the shared cache
+    cache_key = f"recipe/{collection}/{id}"
+    response = None if app.debug else await pagecache.get_page(request, cache_key, etag)
+    if response is None:
+        response = await render(
+            "recipe.html",
+            headers={"ETag": etag},
+            context={
+                "collection": collection,
+                "recipe": recipe,
+                "recipe_id": id,
+                "steps": await cookbook.get_recipe_steps(collection, id),
+                "is_admin": is_admin,
+                "is_user": is_user,
+            }
+        )
+        if not app.debug:
+            await pagecache.cache_page(request, cache_key, etag, response)
 
-    if username is not None:
-        requser = await users.get_user(username)
-    else:
-        requser = None
-
-    comments_users = []
-    user_comment = None
-    found_admin_comment = False
-    for comment, user in await comments.get_comments(collection, id):
-        if requser is not None and user.id == requser.id:
-            # select user comment
-            user_comment = comment
-        else:
-            # place admin comment at the top
-            if user.username == os.environ.get("ADMIN_USER", "admin"):
-                comments_users.insert(0, (comment, user))
-                found_admin_comment = True
-            else:
-                comments_users.append((comment, user))
-
-    response = await render(
-        "recipe.html",
-        headers={"ETag": etag},
-        context={
-            "collection": collection,
-            "recipe": recipe,
-            "recipe_id": id,
-            "is_admin": is_admin,
-            "is_user": is_user,
-            "user_comment": user_comment,
-            "comments_users": comments_users,
-            "found_admin_comment": found_admin_comment,
-            "viewcount": await _get_or_increment_recipe_views(request, collection, id),
-        }
-    )
+    if public:
+        return edgecache.make_public(request, response, surrogate_keys)
 
     response.add_cookie("last-recipe", id)
     response.add_cookie("last-collection", collection)
@@ -229,12 +406,33 @@ async def recipe(request: Request, collection: str, id: str):
     return response
 
 
-@app.get("/views/<collection:str>/<id:str>")
-async def recipe_views(request: Request, collection: str, id: str):
-    """ Get viewcount for a single recipe """
-    return sanic.json({
-        id: await _get_or_increment_recipe_views(request, collection, id)
-    })
+@app.get("/comments/<collection:str>/<id:str>")
+async def recipe_comments(request: Request, collection: str, id: str):
+    """ Reviews of a recipe, loaded into the recipe page """
+    recipes = await cookbook.get_recipes(collection)
+    if id not in recipes:
+        raise NotFound("No such recipe exists on this website")
+
+    # the viewcount of the page is shown from the reviews, a single request
+    # and database round trip for all data of the recipe that is not cached
+    reviews = await pages.get_recipe_reviews(
+        collection, id,
+        username=auth.get_username(request),
+        new_view=_is_new_recipe_view(request, collection, id)
+    )
+    return await render(
+        "recipe_comments.html",
+        context={
+            "collection": collection,
+            "recipe_id": id,
+            "language": recipes[id].meta.language,
+            "is_user": auth.is_user(request),
+            "user_comment": reviews.user_comment,
+            "comments_users": reviews.comments_users,
+            "found_admin_comment": reviews.found_admin_comment,
+            "viewcount": reviews.viewcount,
+        }
+    )
 
 
 # extra endpoint with a "pretty recipe name"
@@ -67,6 +67,9 @@ def init_session(app: Sanic, prefix="session", cookie_name="session", expiration
         """ Save session on response """
         if not hasattr(request.ctx, "session"):
             return
+        if getattr(request.ctx, "public", False):
+            # public responses are cached for everyone, without cookies
+            return
         
         session: SessionDict = request.ctx.session
         if not session:
@@ -0,0 +1,19 @@
+const comments_url = document.currentScript.getAttribute("data-url");
+
+function getComments() {
+    $.ajax({
+        type: 'GET',
+        url: comments_url,
+        success: function(response) {
+            $("#reviews").html(response);
+            // the viewcount is sent with the reviews
+            $(".viewcount-value").html($("#reviewsViewcount").data("viewcount"));
+        },
+        error: function(xhr, status, error) {
+            console.error(`failed to retrieve reviews: ${error}`)
+        }
+    });
+}
+
+// load reviews on document load
+$(document).ready(getComments);
@@ -27,14 +27,12 @@ function updateRating(stars) {
     $('#userRating').attr('data-rating', stars);
 }
 
-// Handle star clicks for user rating
-$(document).ready(function() {
-    $('#userRating span').on('click', function() {
-        if ($('#userRating').hasClass('editing')) {
-            let stars = $(this).index() + 1;
-            updateRating(stars);
-        }
-    });
+// Handle star clicks for user rating, the reviews are loaded after the page
+$(document).on('click', '#userRating span', function() {
+    if ($('#userRating').hasClass('editing')) {
+        let stars = $(this).index() + 1;
+        updateRating(stars);
+    }
 })
 
 function submitReview() {
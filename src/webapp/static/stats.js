@@ -0,0 +1,24 @@
+const stats_url = document.currentScript.getAttribute("data-url");
+
+function getStats() {
+    $.ajax({
+        type: 'GET',
+        url: stats_url,
+        contentType: 'application/json',
+        success: function(response) {
+            for (const [recipe, stats] of Object.entries(response)) {
+                $(`#recipe${recipe} .viewcount-value`).html(stats.views);
+                if (stats.rating !== null) {
+                    $(`#recipe${recipe} .rating-value`).html(stats.rating.toFixed(1));
+                    $(`#recipe${recipe} .rating`).removeClass('hidden');
+                }
+            }
+        },
+        error: function(xhr, status, error) {
+            console.error(`failed to retrieve stats: ${error}`)
+        }
+    });
+}
+
+// load stats on document load
+$(document).ready(getStats);
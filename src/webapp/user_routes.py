@@ -28,12 +28,13 @@ def add_user_routes(app: Sanic):
         username = request.form.get("username").strip()
         password = request.form.get("password")
 
-        if await users.login_user(username, password):
+        user = await users.login_user(username, password)
+        if user is not None:
             redirect = dict(request.query_args).get("redirect", "/")
             response = sanic.json({
                 "redirect": redirect
             })
-            auth.login_user(username, request, response)
+            auth.login_user(username, request, response, user.id)
             return response
         
         return sanic.json({
@@ -83,7 +84,7 @@ def add_user_routes(app: Sanic):
         # failed attempts will trigger rate limiting
         await RateLimiter(times=1, hours=1)(request)
         try:
-            await users.register_user(username, password)
+            user_id = await users.register_user(username, password)
         except users.UserExistsException as e:
             return sanic.json({
                 "error": "Username already exists"
@@ -91,7 +92,7 @@ def add_user_routes(app: Sanic):
         
         # login user
         response = sanic.json({"redirect": app.url_for("registered")})
-        auth.login_user(username, request, response)
+        auth.login_user(username, request, response, user_id)
         return response
 
     @app.get("/forgot-password")
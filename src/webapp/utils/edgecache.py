@@ -0,0 +1,85 @@
+""" Pages for anonymous visitors, cacheable by a shared cache in front of
+the app (a caching proxy or CDN), enabled with EDGE_CACHE_TTL.
+
+Public pages are sent without cookies, with Cache-Control: public, s-maxage
+and a Surrogate-Key header, so the shared cache can purge them when the
+recipes change. Purges are POSTed to EDGE_PURGE_URL as
+    {"surrogate_keys": [...]}
+The shared cache should bypass the cache for requests with the login (JWT) cookie,
+as pages for logged in users are not public. """
+
+from sanic import Request, HTTPResponse
+import asyncio
+import aiohttp
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+# lifetime of public pages in the shared cache, in seconds, 0 disables it
+EDGE_CACHE_TTL = int(os.environ.get("EDGE_CACHE_TTL", 0))
+EDGE_PURGE_URL = os.getenv("EDGE_PURGE_URL")
+
+# purges wait for the other workers to pick up the pushed collection,
+# so the shared cache does not retrieve the old page from them again
+EDGE_PURGE_DELAY = float(os.environ.get("EDGE_PURGE_DELAY", 1))
+
+ENABLED = EDGE_CACHE_TTL > 0
+
+# purges in flight
+_purges: set[asyncio.Task] = set()
+
+
+def collection_keys(collection: str, sha: str | None = None) -> list[str]:
+    """ Surrogate keys for a collection page """
+    keys = [f"collection:{collection}"]
+    if sha is not None:
+        keys.append(f"sha:{sha}")
+    return keys
+
+
+def recipe_keys(collection: str, recipe_id: str, sha: str | None = None) -> list[str]:
+    """ Surrogate keys for a recipe page """
+    keys = [f"recipe:{collection}/{recipe_id}"]
+    if sha is not None:
+        keys.append(f"sha:{sha}")
+    return keys
+
+
+def is_public(request: Request) -> bool:
+    """ Check if the response to a request may be stored in the shared cache """
+    return ENABLED \
+        and request.method == "GET" \
+        and not request.ctx.user \
+        and not request.app.debug
+
+
+def make_public(request: Request, response: HTTPResponse, keys: list[str]) -> HTTPResponse:
+    """ Mark a response as public, it is sent without cookies """
+    response.headers["Cache-Control"] = f"public, max-age=0, s-maxage={EDGE_CACHE_TTL}"
+    response.headers["Surrogate-Key"] = " ".join(keys)
+    request.ctx.public = True
+    return response
+
+
+async def _purge(keys: list[str]):
+    await asyncio.sleep(EDGE_PURGE_DELAY)
+    try:
+        async with aiohttp.ClientSession() as session:
+            async with session.post(EDGE_PURGE_URL, json={"surrogate_keys": keys}) as response:
+                response.raise_for_status()
+    except aiohttp.ClientError as e:
+        logger.warning(f"Failed to purge {' '.join(keys)} from the shared cache: {e}")
+
+
+async def purge_recipes(collection: str, recipe_ids: list[str]):
+    """ Purge the pages of a changed collection from the shared cache """
+    if not ENABLED or EDGE_PURGE_URL is None:
+        return
+
+    keys = collection_keys(collection)
+    for recipe_id in recipe_ids:
+        keys.extend(recipe_keys(collection, recipe_id))
+    task = asyncio.create_task(_purge(keys))
+    _purges.add(task)
+    task.add_done_callback(_purges.discard)
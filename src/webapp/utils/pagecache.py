@@ -0,0 +1,142 @@
+""" Cache of rendered pages, keyed by their ETag and content encoding.
+
+Pages are stored compressed, so a cache hit skips rendering, minifying
+and compressing entirely. The cache is kept per worker, with a memory cap,
+and can be shared between workers through Redis (PAGE_CACHE_SHARED=1). """
+
+from sanic import Request, HTTPResponse
+from collections import OrderedDict
+import redis.asyncio as redis
+import msgspec.msgpack
+import hashlib
+import logging
+import os
+
+from .compress import _compress_response
+
+logger = logging.getLogger(__name__)
+
+# maximum total size of the cached pages per worker, in bytes
+PAGE_CACHE_SIZE = int(os.environ.get("PAGE_CACHE_SIZE", 32 * 1024 * 1024))
+
+# lifetime of pages in the shared cache, in seconds
+PAGE_CACHE_TTL = int(os.environ.get("PAGE_CACHE_TTL", 60 * 60))
+
+_REDIS_URL = os.getenv("REDIS_URL")
+SHARED = _REDIS_URL is not None and bool(int(os.environ.get("PAGE_CACHE_SHARED", "0")))
+
+PREFIX = "page"
+
+
+class CachedPage(msgspec.Struct):
+    body: bytes
+    content_type: str
+    headers: dict[str, str]
+
+
+class PageCache:
+
+    """ LRU cache of pages, evicting the least recently
+    used pages when their total size exceeds max_size """
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self.size = 0
+        self._pages: OrderedDict[str, CachedPage] = OrderedDict()
+
+    def __len__(self):
+        return len(self._pages)
+
+    def get(self, key: str) -> CachedPage | None:
+        page = self._pages.get(key)
+        if page is not None:
+            self._pages.move_to_end(key)
+        return page
+
+    def put(self, key: str, page: CachedPage):
+        if len(page.body) > self.max_size:
+            return
+        old = self._pages.pop(key, None)
+        if old is not None:
+            self.size -= len(old.body)
+        self._pages[key] = page
+        self.size += len(page.body)
+        while self.size > self.max_size:
+            _, evicted = self._pages.popitem(last=False)
+            self.size -= len(evicted.body)
+
+
+_cache = PageCache(PAGE_CACHE_SIZE)
+_redis = redis.from_url(_REDIS_URL) if SHARED else None
+_encoder = msgspec.msgpack.Encoder()
+_decoder = msgspec.msgpack.Decoder(CachedPage)
+
+# pages rendered from other templates should not be shared, see init_page_cache
+_version = ""
+
+
+def _get_key(request: Request, key: str, etag: str) -> str:
+    encoding = "gzip" if "gzip" in request.headers.get("Accept-Encoding", "").lower() else "identity"
+    return f"{_version}:{key}:{etag}:{encoding}"
+
+
+def _to_response(page: CachedPage, etag: str) -> HTTPResponse:
+    return HTTPResponse(
+        page.body,
+        headers={**page.headers, "ETag": etag},
+        content_type=page.content_type
+    )
+
+
+async def get_page(request: Request, key: str, etag: str) -> HTTPResponse | None:
+    """ Get a cached page by name and ETag, in an encoding the client accepts """
+    cache_key = _get_key(request, key, etag)
+    page = _cache.get(cache_key)
+    if page is None and _redis is not None:
+        try:
+            value = await _redis.get(f"{PREFIX}:{cache_key}")
+        except redis.RedisError as e:
+            logger.warning(f"Shared page cache unavailable: {e}")
+            value = None
+        if value is not None:
+            page = _decoder.decode(value)
+            _cache.put(cache_key, page)
+
+    if page is None:
+        return None
+    return _to_response(page, etag)
+
+
+async def cache_page(request: Request, key: str, etag: str, response: HTTPResponse) -> HTTPResponse:
+    """ Compress a rendered page, and cache it by name and ETag.
+    The page should not depend on anything but its ETag. """
+    await _compress_response(request, response)
+    page = CachedPage(
+        body=response.body,
+        content_type=response.content_type,
+        headers={
+            header: response.headers[header]
+            for header in ("Content-Encoding", "Vary")
+            if header in response.headers
+        }
+    )
+
+    cache_key = _get_key(request, key, etag)
+    _cache.put(cache_key, page)
+    if _redis is not None:
+        try:
+            await _redis.set(f"{PREFIX}:{cache_key}", _encoder.encode(page), ex=PAGE_CACHE_TTL)
+        except redis.RedisError as e:
+            logger.warning(f"Shared page cache unavailable: {e}")
+    return response
+
+
+def init_page_cache(template_dir: str):
+    """ Version the cached pages by the templates they were rendered from """
+    global _version
+    templates = hashlib.sha256(usedforsecurity=False)
+    for root, _, files in sorted(os.walk(template_dir)):
+        for file in sorted(files):
+            with open(os.path.join(root, file), "rb") as f:
+                templates.update(f.read())
+    _version = templates.hexdigest()[:12]
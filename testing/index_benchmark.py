@@ -0,0 +1,131 @@
+""" Check the query plans of the recipe stats, reviews and saves lookups on a filled database.
+
+Creates the tables from the models in a scratch schema of DATABASE_URL,
+fills them with COMMENTS comments and saves on RECIPES recipes, and prints
+the plan of every query the app runs on them. The schema is dropped after.
+Run from src/webapp: python ../../testing/index_benchmark.py """
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+import asyncio
+import os
+import sys
+
+sys.path.insert(0, os.getcwd())
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import create_async_engine
+from data.models import Base
+
+RECIPES = 100_000
+COMMENTS = 400_000
+COLLECTIONS = 10
+SCHEMA = "index_benchmark"
+
+# recipe i is in collection i % COLLECTIONS, user u comments on and saves every recipe once
+_RECIPE = f"'collection' || (i % {RECIPES} % {COLLECTIONS}), 'recipe' || (i % {RECIPES})"
+_USER = f"i / {RECIPES}"
+
+# queries of routes.py (_get_recipe_stats), data/pages.py, data/stats.py and data/saves.py
+QUERIES = {
+    # index scan of the primary key
+    "stats of a collection": """
+        SELECT * FROM recipe_stats WHERE recipe_collection = 'collection0'
+    """,
+    # index scan of the comments index, the text is read from the table
+    "reviews of a recipe": """
+        SELECT (
+            SELECT coalesce(max(views.viewcount), 0) FROM views
+            WHERE views.recipe_collection = 'collection0' AND views.recipe_id = 'recipe10'
+        ), comments.*, users.*
+        FROM (SELECT 1 AS anchor) AS anchor
+        LEFT OUTER JOIN comments ON comments.recipe_collection = 'collection0' AND comments.recipe_id = 'recipe10'
+        LEFT OUTER JOIN users ON comments.user_id = users.id
+        ORDER BY comments.id
+    """,
+    # index only scans
+    "comment stats of a recipe": """
+        SELECT count(*), coalesce(sum(rating), 0) FROM comments
+        WHERE recipe_collection = 'collection0' AND recipe_id = 'recipe10'
+    """,
+    "save stats of a recipe": """
+        SELECT count(*) FROM saves
+        WHERE recipe_collection = 'collection0' AND recipe_id = 'recipe10'
+    """,
+    "saves of a user": """
+        SELECT recipe_id FROM saves
+        WHERE user_id = 2 AND recipe_collection = 'collection0'
+    """,
+}
+
+
+async def main():
+    url = os.environ["DATABASE_URL"]
+    admin = create_async_engine(url, isolation_level="AUTOCOMMIT")
+    async with admin.connect() as conn:
+        await conn.execute(text(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE"))
+        await conn.execute(text(f"CREATE SCHEMA {SCHEMA}"))
+
+    engine = create_async_engine(
+        url,
+        isolation_level="AUTOCOMMIT",
+        connect_args={"server_settings": {"search_path": SCHEMA}}
+    )
+    try:
+        async with engine.connect() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+            await conn.execute(text(f"""
+                INSERT INTO users (id, username, password, verified, date_registered)
+                SELECT u, 'user' || u, '', true, now()
+                FROM generate_series(0, {COMMENTS // RECIPES - 1}) AS u
+            """))
+            await conn.execute(text(f"""
+                INSERT INTO comments (recipe_collection, recipe_id, user_id, rating, text, date_posted)
+                SELECT {_RECIPE}, {_USER}, 1 + i % 5, 'comment ' || i, now()
+                FROM generate_series(0, {COMMENTS - 1}) AS i
+            """))
+            await conn.execute(text(f"""
+                INSERT INTO saves (user_id, recipe_collection, recipe_id)
+                SELECT {_USER}, {_RECIPE}
+                FROM generate_series(0, {COMMENTS - 1}) AS i
+            """))
+            await conn.execute(text(f"""
+                INSERT INTO views (recipe_collection, recipe_id, viewcount)
+                SELECT {_RECIPE}, 1 + i % 100
+                FROM generate_series(0, {RECIPES - 1}) AS i
+            """))
+            await conn.execute(text(f"""
+                INSERT INTO recipe_stats (recipe_collection, recipe_id, viewcount, comment_count, rating_sum, save_count)
+                SELECT recipe_collection, recipe_id, SUM(viewcount), SUM(comment_count), SUM(rating_sum), SUM(save_count)
+                FROM (
+                    SELECT recipe_collection, recipe_id, viewcount, 0 AS comment_count, 0 AS rating_sum, 0 AS save_count FROM views
+                    UNION ALL
+                    SELECT recipe_collection, recipe_id, 0, 1, rating, 0 FROM comments
+                    UNION ALL
+                    SELECT recipe_collection, recipe_id, 0, 0, 0, 1 FROM saves
+                ) AS stats
+                GROUP BY recipe_collection, recipe_id
+            """))
+
+            # index only scans need the visibility map
+            for table in ("users", "comments", "saves", "views", "recipe_stats"):
+                await conn.execute(text(f"VACUUM ANALYZE {table}"))
+
+            for name, query in QUERIES.items():
+                result = await conn.execute(text(f"EXPLAIN (ANALYZE, BUFFERS) {query}"))
+                plan = [row[0] for row in result.all()]
+                scans = [line.strip(" ->").split(" on ")[0] for line in plan if " on " in line and "Scan" in line]
+                print(f"{name}: {', '.join(scans)}")
+                for line in plan:
+                    print(f"    {line}")
+    finally:
+        async with admin.connect() as conn:
+            await conn.execute(text(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE"))
+        await engine.dispose()
+        await admin.dispose()
+
+
+if __name__ == '__main__':
+    asyncio.run(main())